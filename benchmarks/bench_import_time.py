@@ -0,0 +1,108 @@
+"""
+Import-time budget check for cold start.
+
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --budget-ms 400 --top 15
+
+Each scenario runs in a fresh interpreter under ``python -X importtime``.
+The script reports the total, less interpreter startup, and the slowest
+imports. It exits non-zero if a scenario goes over its budget or imports
+a heavy SDK (OpenAI, Azure, pypdf) eagerly; those should only load on
+first use or in an explicit ChatPipeline.warm_up().
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (code, default budget in ms)
+SCENARIOS = {
+    # What manage.py commands, migrations, tests and worker boot pay.
+    "urlconf": (
+        "import django; django.setup(); import medassit_backend.urls",
+        600,
+    ),
+    # Pure helpers shared with ingest.py; no Django involved.
+    "helpers": (
+        "import medassist_backend_app.azure_clients, "
+        "medassist_backend_app.quantization, medassist_backend_app.diversity",
+        50,
+    ),
+}
+
+FORBIDDEN_PREFIXES = ("openai", "azure", "pypdf", "httpx")
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(code: str):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="medassit_backend.settings")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    modules = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules.append((name, int(self_us), int(cumulative_us)))
+        if len(indent) == 1:
+            total_us += int(cumulative_us)
+
+    return total_us, modules
+
+
+def startup_baseline_us() -> int:
+    # Imports the bare interpreter does anyway (site, encodings, ...).
+    return measure("pass")[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    parser.add_argument("--budget-ms", type=float, help="Override every scenario's budget.")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline_us = startup_baseline_us()
+    failed = False
+    for name in args.scenarios:
+        code, budget_ms = SCENARIOS[name]
+        budget_ms = args.budget_ms or budget_ms
+
+        try:
+            total_us, modules = measure(code)
+            total_us -= baseline_us
+        except RuntimeError as e:
+            print(f"[{name}] could not run: {e}")
+            failed = True
+            continue
+
+        eager = sorted({m for m, _, _ in modules if m.startswith(FORBIDDEN_PREFIXES)})
+        over = total_us / 1000 > budget_ms
+        failed |= over or bool(eager)
+
+        status = "FAIL" if over or eager else "ok"
+        print(f"[{name}] {total_us / 1000:.1f} ms (budget {budget_ms:.0f} ms) {status}")
+        for module, self_us, cumulative_us in sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {module}")
+        if eager:
+            print(f"    eagerly imported: {', '.join(eager[:10])}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
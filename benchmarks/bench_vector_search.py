@@ -0,0 +1,117 @@
+"""
+Recall / latency / memory trade-offs of the quantized local vector index.
+
+    python benchmarks/bench_vector_search.py
+    python benchmarks/bench_vector_search.py --index ./local_index --queries 50
+
+Without --index a synthetic clustered corpus is generated. Recall@k is
+measured against exact float32 search over the full-width vectors.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from medassist_backend_app.quantization import (  # noqa: E402
+    LocalVectorIndex,
+    dot,
+    normalize,
+    truncate_embedding,
+)
+
+
+def synthetic_corpus(n: int, dimensions: int, clusters: int, seed: int):
+    rng = random.Random(seed)
+    centers = [normalize([rng.gauss(0, 1) for _ in range(dimensions)]) for _ in range(clusters)]
+    vectors = []
+    for i in range(n):
+        center = centers[i % clusters]
+        vectors.append(normalize([c + rng.gauss(0, 0.5 / dimensions ** 0.5) for c in center]))
+    return [f"doc-{i}" for i in range(n)], vectors
+
+
+def noisy_queries(vectors, count: int, seed: int):
+    rng = random.Random(seed + 1)
+    dimensions = len(vectors[0])
+    return [
+        normalize([x + rng.gauss(0, 0.2 / dimensions ** 0.5) for x in rng.choice(vectors)])
+        for _ in range(count)
+    ]
+
+
+def exact_top_k(query, ids, vectors, k):
+    scored = sorted(zip(ids, vectors), key=lambda iv: dot(query, iv[1]), reverse=True)
+    return [doc_id for doc_id, _ in scored[:k]]
+
+
+def run(args):
+    if args.index:
+        source = LocalVectorIndex.load(args.index)
+        ids, vectors = zip(*source.items())
+        ids, vectors = list(ids), list(vectors)
+    else:
+        ids, vectors = synthetic_corpus(args.docs, args.dimensions, args.clusters, args.seed)
+
+    full_dimensions = len(vectors[0])
+    queries = noisy_queries(vectors, args.queries, args.seed)
+    truth = [exact_top_k(q, ids, vectors, args.k) for q in queries]
+
+    configs = [("float32 exact", None, None)]
+    for mode in ("int8", "binary"):
+        configs.append((f"{mode} two-stage", mode, full_dimensions))
+        for dims in args.truncate:
+            if dims < full_dimensions:
+                configs.append((f"{mode} two-stage @{dims}d", mode, dims))
+
+    print(
+        f"{len(ids)} vectors x {full_dimensions}d, {len(queries)} queries, "
+        f"k={args.k}, rescore N={args.rescore}\n"
+    )
+    print(f"{'config':<28}{'code bytes/vec':>15}{'disk bytes/vec':>15}{'recall@k':>10}{'ms/query':>10}")
+
+    for name, mode, dims in configs:
+        if mode is None:
+            started = time.perf_counter()
+            for q in queries:
+                exact_top_k(q, ids, vectors, args.k)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<28}{full_dimensions * 4:>15}{full_dimensions * 4:>15}{1.0:>10.3f}{elapsed / len(queries) * 1000:>10.1f}")
+            continue
+
+        index = LocalVectorIndex(dims, mode)
+        for doc_id, vector in zip(ids, vectors):
+            index.add(doc_id, truncate_embedding(vector, dims))
+
+        hits = 0
+        started = time.perf_counter()
+        for q, expected in zip(queries, truth):
+            found = index.search(q, k=args.k, rescore_candidates=args.rescore)
+            hits += len({h["id"] for h in found} & set(expected))
+        elapsed = time.perf_counter() - started
+
+        recall = hits / (len(queries) * args.k)
+        print(
+            f"{name:<28}{index.code_bytes() / len(index):>15.0f}{dims * 4:>15}"
+            f"{recall:>10.3f}{elapsed / len(queries) * 1000:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="Benchmark vectors from a saved LocalVectorIndex directory.")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, default=50)
+    parser.add_argument("--truncate", type=int, nargs="*", default=[512, 256])
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import os
 import base64
-from typing import List
+import hashlib
+import sqlite3
+import time
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List
 
 from dotenv import load_dotenv
 from pypdf import PdfReader
 
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-from openai import AzureOpenAI
+from medassist_backend_app.azure_clients import (
+    build_openai_client,
+    build_search_client,
+    call_azure,
+)
+from medassist_backend_app.diversity import CandidateDiversifier
+from medassist_backend_app.quantization import LocalVectorIndex, truncate_embedding
 
 
 # ============================================================
@@ -26,34 +35,167 @@ AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 
 PDF_DIR = "./pdfs"
 
+# Per-page extracted text, keyed by PDF content hash, so re-ingests and
+# re-chunking experiments never re-parse unchanged PDFs.
+EXTRACTED_TEXT_CACHE = os.getenv("EXTRACTED_TEXT_CACHE", "./extracted_text_cache.sqlite3")
+
+UPLOAD_BATCH_SIZE = 100
+
+# Optional Matryoshka truncation (text-embedding-3-* only). The index's
+# contentVector field and the retriever must use the same dimensions.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
+
+# Optional local two-stage vector index written alongside the upload.
+LOCAL_VECTOR_INDEX = os.getenv("LOCAL_VECTOR_INDEX")
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "binary")
+
+# Set to 1 once the index has a retrievable "simhash" field (Edm.String).
+SEARCH_SIMHASH_FIELD = os.getenv("SEARCH_SIMHASH_FIELD", "0") == "1"
+
+# Rewritten after every run; the backend's generation cache is keyed on it.
+INDEX_VERSION_FILE = os.getenv("INDEX_VERSION_FILE", "./index_version")
+
 
 # ============================================================
 # Clients
 # ============================================================
-search_client = SearchClient(
-    endpoint=AZURE_SEARCH_ENDPOINT,
-    index_name=AZURE_SEARCH_INDEX,
-    credential=AzureKeyCredential(AZURE_SEARCH_KEY),
+search_client = build_search_client(
+    AZURE_SEARCH_ENDPOINT,
+    AZURE_SEARCH_INDEX,
+    AZURE_SEARCH_KEY,
 )
 
-openai_client = AzureOpenAI(
-    azure_endpoint=AZURE_OPENAI_EMBEDDING_ENDPOINT,
-    api_key=AZURE_OPENAI_EMBEDDING_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
+openai_client = build_openai_client(
+    AZURE_OPENAI_EMBEDDING_ENDPOINT,
+    AZURE_OPENAI_EMBEDDING_KEY,
+    AZURE_OPENAI_API_VERSION,
 )
 
 
+# ============================================================
+# Extracted text cache
+# ============================================================
+class PdfTextCache:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pdf_files (
+                file_hash TEXT PRIMARY KEY,
+                page_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pdf_pages (
+                file_hash TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                text BLOB NOT NULL,
+                PRIMARY KEY (file_hash, page_number)
+            );
+        """)
+
+    @staticmethod
+    def file_hash(pdf_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_complete(self, file_hash: str) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM pdf_files WHERE file_hash = ?", (file_hash,)
+        ).fetchone()
+        return row is not None
+
+    def iter_pages(self, file_hash: str) -> Iterator[str]:
+        cursor = self.connection.execute(
+            "SELECT text FROM pdf_pages WHERE file_hash = ? ORDER BY page_number",
+            (file_hash,),
+        )
+        for (blob,) in cursor:
+            yield zlib.decompress(blob).decode("utf-8")
+
+    def store_pages(self, file_hash: str, pages: Iterable[str]) -> Iterator[str]:
+        """
+        Passes pages through while caching them; the file is only marked
+        complete once every page has been stored.
+        """
+        self.connection.execute("DELETE FROM pdf_pages WHERE file_hash = ?", (file_hash,))
+        count = 0
+        for count, text in enumerate(pages, start=1):
+            self.connection.execute(
+                "INSERT INTO pdf_pages (file_hash, page_number, text) VALUES (?, ?, ?)",
+                (file_hash, count, zlib.compress(text.encode("utf-8"))),
+            )
+            yield text
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pdf_files (file_hash, page_count) VALUES (?, ?)",
+            (file_hash, count),
+        )
+        self.connection.commit()
+
+
 # ============================================================
 # Utility functions
 # ============================================================
-def extract_text_from_pdf(pdf_path: str) -> str:
+def parse_pdf_pages(pdf_path: str) -> Iterator[str]:
     reader = PdfReader(pdf_path)
-    pages = []
     for page in reader.pages:
         text = page.extract_text()
         if text:
-            pages.append(text)
-    return "\n".join(pages)
+            yield text
+
+
+def iter_pdf_pages(pdf_path: str, cache: PdfTextCache | None = None) -> Iterator[str]:
+    if cache is None:
+        yield from parse_pdf_pages(pdf_path)
+        return
+
+    file_hash = cache.file_hash(pdf_path)
+    if cache.is_complete(file_hash):
+        yield from cache.iter_pages(file_hash)
+    else:
+        yield from cache.store_pages(file_hash, parse_pdf_pages(pdf_path))
+
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    return "\n".join(iter_pdf_pages(pdf_path))
+
+
+def chunk_pages(
+    pages: Iterable[str],
+    chunk_size: int = 1000,
+    overlap: int = 200
+) -> Iterator[str]:
+    """
+    Streaming equivalent of chunk_text("\n".join(pages)): yields the same
+    chunks while only holding about one chunk plus one page in memory.
+    """
+    buffer = ""
+    offset = 0  # absolute position of buffer[0]
+    start = 0
+    length = 0
+
+    for i, page in enumerate(pages):
+        piece = page if i == 0 else "\n" + page
+        buffer += piece
+        length += len(piece)
+
+        while start + chunk_size <= length:
+            end = start + chunk_size
+            chunk = buffer[start - offset:end - offset].strip()
+            if chunk:
+                yield chunk
+            start = end - overlap
+
+        buffer = buffer[start - offset:]
+        offset = start
+
+    while start < length:
+        end = start + chunk_size
+        chunk = buffer[start - offset:end - offset].strip()
+        if chunk:
+            yield chunk
+        start = end - overlap
 
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
@@ -72,11 +214,16 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[st
 
 
 def embed_text(text: str) -> List[float]:
-    response = openai_client.embeddings.create(
-        model=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
-        input=text,
+    response = call_azure(
+        "embedding",
+        AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        lambda timeout: openai_client.embeddings.create(
+            model=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+            input=text,
+            timeout=timeout,
+        ),
     )
-    return response.data[0].embedding
+    return truncate_embedding(response.data[0].embedding, EMBEDDING_DIMENSIONS)
 
 
 def safe_id(raw_text: str) -> str:
@@ -92,20 +239,59 @@ def safe_id(raw_text: str) -> str:
 # ============================================================
 # Ingestion logic
 # ============================================================
-def ingest_pdf(pdf_path: str):
-    print(f"\n📄 Processing PDF: {pdf_path}")
+def load_local_vectors() -> Dict[str, array]:
+    if not LOCAL_VECTOR_INDEX or not os.path.exists(
+        os.path.join(LOCAL_VECTOR_INDEX, "meta.json")
+    ):
+        return {}
+
+    index = LocalVectorIndex.load(LOCAL_VECTOR_INDEX)
+    if index.dimensions != (EMBEDDING_DIMENSIONS or index.dimensions):
+        print("⚠️ Local index dimensions changed, rebuilding from scratch.")
+        return {}
+
+    return {doc_id: array("f", vector) for doc_id, vector in index.items()}
+
+
+def save_local_index(vectors: Dict[str, array]):
+    dimensions = len(next(iter(vectors.values())))
+    index = LocalVectorIndex(dimensions, VECTOR_QUANTIZATION)
+    for doc_id, vector in vectors.items():
+        index.add(doc_id, vector)
+
+    index.save(LOCAL_VECTOR_INDEX)
+    print(
+        f"🗂️ Local {VECTOR_QUANTIZATION} index: {len(index)} vectors, "
+        f"{index.code_bytes()} bytes of codes in memory"
+    )
 
-    text = extract_text_from_pdf(pdf_path)
-    if not text.strip():
-        print("⚠️ No text extracted, skipping.")
-        return
 
-    chunks = chunk_text(text)
-    print(f"🔹 Total chunks created: {len(chunks)}")
+def upload_documents(documents: List[Dict]):
+    call_azure(
+        "search",
+        AZURE_SEARCH_INDEX,
+        lambda timeout: search_client.upload_documents(documents, timeout=timeout),
+    )
+
+
+def ingest_pdf(
+    pdf_path: str,
+    cache: PdfTextCache | None = None,
+    local_vectors: Dict[str, array] | None = None
+) -> int:
+    print(f"\n📄 Processing PDF: {pdf_path}")
+
+    # Pages stream from the cache (or the parser) into the chunker, and
+    # documents are uploaded in batches, so memory stays bounded even for
+    # very large guidelines.
+    chunks = chunk_pages(iter_pdf_pages(pdf_path, cache))
 
     documents = []
+    total_chunks = 0
+    uploaded = 0
 
     for i, chunk in enumerate(chunks):
+        total_chunks += 1
         try:
             embedding = embed_text(chunk)
 
@@ -117,18 +303,38 @@ def ingest_pdf(pdf_path: str):
                 "source": "WHO,CDC,NIH",  # Example source
                 "year": 2024  # Example year
             }
+            if SEARCH_SIMHASH_FIELD:
+                document["simhash"] = CandidateDiversifier.simhash_hex(chunk)
 
             documents.append(document)
 
+            if local_vectors is not None:
+                local_vectors[document["id"]] = array("f", embedding)
+
         except Exception as e:
             print(f"❌ Error embedding chunk {i}: {e}")
 
+        if len(documents) >= UPLOAD_BATCH_SIZE:
+            upload_documents(documents)
+            uploaded += len(documents)
+            documents = []
+
     if documents:
-        result = search_client.upload_documents(documents)
-        print(f"✅ Uploaded {len(documents)} chunks to Azure AI Search")
+        upload_documents(documents)
+        uploaded += len(documents)
+
+    if not total_chunks:
+        print("⚠️ No text extracted, skipping.")
+        return 0
+
+    print(f"🔹 Total chunks created: {total_chunks}")
+    if uploaded:
+        print(f"✅ Uploaded {uploaded} chunks to Azure AI Search")
     else:
         print("⚠️ No documents to upload.")
 
+    return uploaded
+
 
 # ============================================================
 # Main runner
@@ -146,8 +352,20 @@ def main():
         print("⚠️ No PDF files found.")
         return
 
+    cache = PdfTextCache(EXTRACTED_TEXT_CACHE) if EXTRACTED_TEXT_CACHE else None
+    local_vectors = load_local_vectors() if LOCAL_VECTOR_INDEX else None
+
     for pdf_file in pdf_files:
-        ingest_pdf(os.path.join(PDF_DIR, pdf_file))
+        ingest_pdf(os.path.join(PDF_DIR, pdf_file), cache, local_vectors)
+
+    if local_vectors:
+        save_local_index(local_vectors)
+
+    version = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    with open(INDEX_VERSION_FILE + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(INDEX_VERSION_FILE + ".tmp", INDEX_VERSION_FILE)
+    print(f"🏷️ Index version: {version}")
 
     print("\n🎉 Ingestion completed successfully.")
 
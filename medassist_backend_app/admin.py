@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ConversationSession
+
+
+@admin.register(ConversationSession)
+class ConversationSessionAdmin(admin.ModelAdmin):
+    list_display = ("session_id", "updated_at")
+    readonly_fields = ("turns", "chunk_ids", "created_at", "updated_at")
@@ -0,0 +1,397 @@
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+from .deadlines import DeadlineExceeded, remaining_time
+
+# The OpenAI and Azure SDKs are imported on first use, not at import time,
+# so manage.py commands, migrations and tests never pay for them.
+if TYPE_CHECKING:
+    from azure.search.documents import SearchClient
+    from openai import AzureOpenAI
+
+
+# ============================================================
+# Per-deployment limits
+# ============================================================
+# kind -> (requests/sec, burst, initial concurrency, max concurrency, timeout s)
+LIMIT_DEFAULTS = {
+    "chat": (4.0, 8.0, 8, 32, 30.0),
+    "embedding": (20.0, 40.0, 16, 64, 10.0),
+    "search": (15.0, 30.0, 16, 64, 10.0),
+}
+
+# Kinds whose idempotent reads may be hedged.
+HEDGED_KINDS = ("embedding", "search")
+SEARCH_CONNECT_TIMEOUT_S = 5.0
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 4
+BASE_BACKOFF_S = 0.5
+MAX_BACKOFF_S = 8.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        # Server asked us to back off (retry-after): stop handing out tokens
+        # for everyone on this deployment, then refill from empty.
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self._updated = until
+                self._tokens = 0.0
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    elapsed = max(0.0, now - self._updated)
+                    self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait_for = (1 - self._tokens) / self.rate
+                else:
+                    wait_for = self._paused_until - now
+
+            if give_up_at is not None and now + wait_for > give_up_at:
+                return False
+            time.sleep(wait_for)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrent calls: grows by ~1 per window of successful
+    calls and halves on throttling (at most once per cooldown so a burst of
+    429s from the same overload counts once).
+    """
+
+    DECREASE_COOLDOWN_S = 1.0
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1, backoff: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        with self._cond:
+            acquired = self._cond.wait_for(
+                lambda: self._in_flight < int(self.limit), timeout
+            )
+            if acquired:
+                self._in_flight += 1
+            return acquired
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.DECREASE_COOLDOWN_S:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class DeploymentGuard:
+    HEDGE_MIN_DELAY_S = 0.2
+    HEDGE_COLD_DELAY_S = 1.0
+    HEDGE_PERCENTILE = 0.9
+
+    def __init__(self, kind: str, name: str):
+        rate, burst, initial, maximum, timeout = LIMIT_DEFAULTS[kind]
+        prefix = f"AZURE_{kind.upper()}"
+
+        self.kind = kind
+        self.name = name
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT_S", timeout))
+        self.bucket = TokenBucket(
+            rate=float(os.getenv(f"{prefix}_RPS", rate)),
+            capacity=float(os.getenv(f"{prefix}_BURST", burst)),
+        )
+        self.limiter = AdaptiveConcurrencyLimiter(
+            initial=initial,
+            maximum=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", maximum)),
+        )
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < 20:
+            return min(self.HEDGE_COLD_DELAY_S, self.timeout / 4)
+        index = int(len(samples) * self.HEDGE_PERCENTILE)
+        return max(self.HEDGE_MIN_DELAY_S, samples[min(index, len(samples) - 1)])
+
+
+_guards: Dict[tuple, DeploymentGuard] = {}
+_guards_lock = threading.Lock()
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool():
+    global _hedge_pool
+
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # Room for every call the limiters can admit, so calls do not
+            # queue here behind each other.
+            workers = sum(
+                int(os.getenv(f"AZURE_{kind.upper()}_MAX_CONCURRENCY", LIMIT_DEFAULTS[kind][3]))
+                for kind in HEDGED_KINDS
+            )
+            _hedge_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="azure-hedge")
+        return _hedge_pool
+
+
+def search_timeouts(timeout: float) -> Dict[str, float]:
+    """
+    Per-call kwargs for SearchClient: azure-core applies ``timeout`` to the
+    connect phase only, so the read is bounded separately.
+    """
+    return {
+        "timeout": timeout,
+        "connection_timeout": min(SEARCH_CONNECT_TIMEOUT_S, timeout),
+        "read_timeout": timeout,
+    }
+
+
+def get_guard(kind: str, name: str) -> DeploymentGuard:
+    key = (kind, name)
+    with _guards_lock:
+        guard = _guards.get(key)
+        if guard is None:
+            guard = DeploymentGuard(kind, name)
+            _guards[key] = guard
+        return guard
+
+
+# ============================================================
+# Error classification
+# ============================================================
+def _status_code(exc: Exception) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def _retry_after(exc: Exception) -> float | None:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+
+    for header, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+
+    return None
+
+
+def _is_retryable(exc: Exception) -> bool:
+    from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+    from openai import APIConnectionError
+
+    if isinstance(exc, (APIConnectionError, ServiceRequestError, ServiceResponseError)):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(MAX_BACKOFF_S, BASE_BACKOFF_S * 2 ** attempt))
+
+
+# ============================================================
+# Guarded calls
+# ============================================================
+def _attempt_timeout(guard: DeploymentGuard) -> float:
+    remaining = remaining_time()
+    if remaining is None:
+        return guard.timeout
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {guard.kind} call to {guard.name}")
+    return min(guard.timeout, remaining)
+
+
+def _first_result(guard: DeploymentGuard, futures: list, within: float | None = None) -> Any:
+    """
+    Result of the first future to succeed (or the last error), waiting no
+    longer than the request deadline. With ``within``, returns None if
+    nothing finished in that time.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    pending = set(futures)
+    error = None
+    while pending:
+        remaining = remaining_time()
+        timeout = within if remaining is None else max(0.0, min(remaining, within or remaining))
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            if within is not None and (remaining is None or within < remaining):
+                return None
+            raise DeadlineExceeded(f"Deadline exceeded waiting on {guard.kind} call to {guard.name}")
+
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        within = None
+
+    raise error
+
+
+def _hedged(guard: DeploymentGuard, fn: Callable[[float], Any], timeout: float) -> Any:
+    hedge_pool = _get_hedge_pool()
+    started = threading.Event()
+
+    def run_primary():
+        started.set()
+        return fn(timeout)
+
+    primary = hedge_pool.submit(contextvars.copy_context().run, run_primary)
+    result = _first_result(guard, [primary], within=guard.hedge_delay())
+    if result is not None or primary.done():
+        return primary.result()
+
+    # Only hedge a call that is actually slow (not still queued in the
+    # pool) and when there is headroom; a hedge must never cause a 429.
+    if (
+        not started.is_set()
+        or not guard.bucket.acquire(timeout=0)
+        or not guard.limiter.acquire(timeout=0)
+    ):
+        return _first_result(guard, [primary])
+
+    backup = hedge_pool.submit(
+        contextvars.copy_context().run, fn, _attempt_timeout(guard)
+    )
+    backup.add_done_callback(lambda _: guard.limiter.release())
+
+    return _first_result(guard, [primary, backup])
+
+
+def call_azure(
+    kind: str,
+    name: str,
+    fn: Callable[[float], Any],
+    hedge: bool = False
+) -> Any:
+    """
+    Runs ``fn(timeout)`` against an Azure deployment under its token bucket
+    and adaptive concurrency limit, retrying throttled and transient
+    failures within the current request deadline. ``hedge`` should only be
+    set for idempotent reads (embeddings, searches).
+    """
+    guard = get_guard(kind, name)
+    attempt = 0
+
+    while True:
+        attempt += 1
+        timeout = _attempt_timeout(guard)
+
+        if not guard.bucket.acquire(timeout=remaining_time()):
+            raise DeadlineExceeded(f"Rate limit wait exceeded deadline for {name}")
+        if not guard.limiter.acquire(timeout=remaining_time()):
+            raise DeadlineExceeded(f"Concurrency wait exceeded deadline for {name}")
+
+        throttled = False
+        started = time.monotonic()
+        try:
+            result = _hedged(guard, fn, timeout) if hedge else fn(timeout)
+        except Exception as exc:
+            throttled = _status_code(exc) == 429
+            if not _is_retryable(exc) or attempt >= MAX_ATTEMPTS:
+                raise
+
+            delay = _retry_after(exc)
+            if delay is None:
+                delay = _backoff(attempt)
+            if throttled:
+                guard.bucket.pause(delay)
+
+            # Out of time (often because this attempt's timeout was clipped
+            # to the deadline): surface it as a deadline, not an SDK error.
+            remaining = remaining_time()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded(
+                    f"Deadline exceeded retrying {kind} call to {name}"
+                ) from exc
+        else:
+            guard.record_latency(time.monotonic() - started)
+            return result
+        finally:
+            guard.limiter.release(throttled=throttled)
+
+        time.sleep(delay)
+
+
+# ============================================================
+# Client factories
+# ============================================================
+# Clients are built on first use and shared per configuration, so
+# components created per request reuse one connection pool.
+@functools.lru_cache(maxsize=None)
+def build_openai_client(endpoint: str, api_key: str, api_version: str) -> "AzureOpenAI":
+    from openai import AzureOpenAI
+
+    # Retries are owned by call_azure so they respect deadlines and limits.
+    return AzureOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        api_version=api_version,
+        max_retries=0,
+        timeout=LIMIT_DEFAULTS["chat"][4],
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def build_search_client(endpoint: str, index_name: str, api_key: str) -> "SearchClient":
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+
+    return SearchClient(
+        endpoint=endpoint,
+        index_name=index_name,
+        credential=AzureKeyCredential(api_key),
+        retry_total=0,
+        connection_timeout=5,
+        read_timeout=LIMIT_DEFAULTS["search"][4],
+    )
@@ -0,0 +1,43 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "medassist_deadline", default=None
+)
+
+
+@contextmanager
+def deadline_scope(seconds: float | None):
+    """
+    Sets an absolute deadline for everything called inside the block.
+    A nested scope can only shorten the enclosing deadline, never extend it.
+    """
+    current = _deadline.get()
+    deadline = None if seconds is None else time.monotonic() + seconds
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(stage: str = "request"):
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
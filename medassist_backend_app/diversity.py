@@ -0,0 +1,117 @@
+import hashlib
+import re
+from typing import Dict, List
+
+
+class CandidateDiversifier:
+    SIMHASH_BITS = 64
+    SHINGLE_WORDS = 3
+
+    # Hamming distance (of 64 bits) at or below which two chunks are
+    # treated as the same text, e.g. guidance repeated across PDFs.
+    NEAR_DUPLICATE_DISTANCE = 3
+
+    # MMR trade-off between relevance (1.0) and novelty (0.0).
+    MMR_LAMBDA = 0.7
+
+
+    @classmethod
+    def simhash(cls, text: str) -> int:
+        words = re.findall(r"\w+", text.lower())
+        n = cls.SHINGLE_WORDS
+        shingles = [" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))]
+
+        weights = [0] * cls.SIMHASH_BITS
+        for shingle in shingles:
+            h = int.from_bytes(
+                hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+            )
+            for bit in range(cls.SIMHASH_BITS):
+                weights[bit] += 1 if h >> bit & 1 else -1
+
+        signature = 0
+        for bit, weight in enumerate(weights):
+            if weight > 0:
+                signature |= 1 << bit
+        return signature
+
+
+    @classmethod
+    def simhash_hex(cls, text: str) -> str:
+        # Stored as a string: Edm.Int64 is signed and would not fit 64 bits.
+        return f"{cls.simhash(text):016x}"
+
+
+    @classmethod
+    def signature(cls, chunk: Dict) -> int:
+        stored = chunk.get("simhash")
+        if stored:
+            return int(stored, 16)
+        return cls.simhash(chunk.get("text") or "")
+
+
+    @staticmethod
+    def cosine(a: List[float], b: List[float]) -> float:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+        return dot / norm if norm else 0.0
+
+
+    @classmethod
+    def similarity(cls, a: Dict, b: Dict) -> float:
+        if a.get("embedding") and b.get("embedding"):
+            return cls.cosine(a["embedding"], b["embedding"])
+
+        # Keyword-only hits carry no vector; fall back to the signature.
+        distance = (a["_signature"] ^ b["_signature"]).bit_count()
+        return 1 - distance / cls.SIMHASH_BITS
+
+
+    @classmethod
+    def suppress_near_duplicates(cls, chunks: List[Dict]) -> List[Dict]:
+        kept = []
+        for chunk in chunks:
+            if all(
+                (chunk["_signature"] ^ k["_signature"]).bit_count() > cls.NEAR_DUPLICATE_DISTANCE
+                for k in kept
+            ):
+                kept.append(chunk)
+        return kept
+
+
+    @classmethod
+    def mmr_select(cls, chunks: List[Dict], k: int) -> List[Dict]:
+        max_score = max((c["score"] for c in chunks), default=0) or 1.0
+        remaining = list(chunks)
+        selected = []
+
+        while remaining and len(selected) < k:
+            best = max(
+                remaining,
+                key=lambda c: (
+                    cls.MMR_LAMBDA * c["score"] / max_score
+                    - (1 - cls.MMR_LAMBDA) * max(
+                        (cls.similarity(c, s) for s in selected), default=0.0
+                    )
+                )
+            )
+            selected.append(best)
+            remaining.remove(best)
+
+        return selected
+
+
+    @classmethod
+    def diversify(cls, chunks: List[Dict], k: int) -> List[Dict]:
+        """
+        Drops near-duplicate chunks (best-scored copy wins), then picks up
+        to ``k`` chunks by maximal marginal relevance over their embeddings.
+        Expects chunks sorted by descending hybrid score.
+        """
+        annotated = [{**c, "_signature": cls.signature(c)} for c in chunks]
+        distinct = cls.suppress_near_duplicates(annotated)
+        selected = cls.mmr_select(distinct, k)
+
+        for c in selected:
+            del c["_signature"]
+        return selected
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+from .caching import LRUCache
+
+
+class GenerationCache:
+    """
+    Final-answer cache keyed by a hash of (prompt messages, deployment,
+    temperature, max_tokens, index version). The pipeline keys on the
+    prompt assembled with the normalized question, so a repeat of the same
+    question differing only in case, spacing or trailing punctuation hits;
+    different questions, evidence, history or templates do not share a
+    generation.
+
+    An in-process LRU with a TTL sits in front of an optional SQLite
+    backend shared by all workers on the host. Entries are tagged with the
+    index version (``INDEX_VERSION`` or the file ingest.py writes), so
+    re-ingesting invalidates them.
+    """
+
+    MEMORY_ENTRIES = int(os.getenv("GENERATION_CACHE_ENTRIES", "1024"))
+    TTL_S = float(os.getenv("GENERATION_CACHE_TTL_S", "86400"))
+    SQLITE_PATH = os.getenv("GENERATION_CACHE_SQLITE")
+    INDEX_VERSION_FILE = os.getenv("INDEX_VERSION_FILE", "./index_version")
+
+    _memory = LRUCache(max_entries=MEMORY_ENTRIES, ttl_s=TTL_S)
+
+    _connection = None
+    _connection_lock = threading.Lock()
+
+    _stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "tokens_saved": 0}
+    _stats_lock = threading.Lock()
+
+    _version = (None, None)
+    _pruned_version = None
+
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return cls.MEMORY_ENTRIES > 0 or bool(cls.SQLITE_PATH)
+
+
+    @classmethod
+    def index_version(cls) -> str:
+        pinned = os.getenv("INDEX_VERSION")
+        if pinned:
+            return pinned
+
+        # Re-read only when the file changes; one stat per lookup.
+        try:
+            mtime = os.stat(cls.INDEX_VERSION_FILE).st_mtime_ns
+        except OSError:
+            return ""
+
+        cached_mtime, version = cls._version
+        if cached_mtime != mtime:
+            with open(cls.INDEX_VERSION_FILE, encoding="utf-8") as f:
+                version = f.read().strip()
+            cls._version = (mtime, version)
+        return version
+
+
+    @classmethod
+    def make_key(
+        cls,
+        messages: Any,
+        deployment: str | None,
+        temperature: float,
+        max_tokens: int
+    ) -> Tuple[str, str]:
+        version = cls.index_version()
+        payload = json.dumps(
+            [messages, deployment, temperature, max_tokens, version],
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest(), version
+
+
+    # ------------------------------------------------
+    @classmethod
+    def _shared(cls) -> sqlite3.Connection | None:
+        if not cls.SQLITE_PATH:
+            return None
+
+        with cls._connection_lock:
+            if cls._connection is None:
+                connection = sqlite3.connect(
+                    cls.SQLITE_PATH, timeout=5, check_same_thread=False
+                )
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("""
+                    CREATE TABLE IF NOT EXISTS generations (
+                        cache_key TEXT PRIMARY KEY,
+                        index_version TEXT NOT NULL,
+                        answer TEXT NOT NULL,
+                        total_tokens INTEGER NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                connection.commit()
+                cls._connection = connection
+            return cls._connection
+
+
+    @classmethod
+    def _count(cls, stat: str, tokens: int = 0):
+        with cls._stats_lock:
+            cls._stats[stat] += 1
+            cls._stats["tokens_saved"] += tokens
+
+
+    @classmethod
+    def get(cls, key: str) -> str | None:
+        entry = cls._memory.get(key)
+        if entry is not None:
+            cls._count("memory_hits", entry[1])
+            return entry[0]
+
+        connection = cls._shared()
+        if connection is not None:
+            with cls._connection_lock:
+                row = connection.execute(
+                    "SELECT answer, total_tokens FROM generations "
+                    "WHERE cache_key = ? AND created_at > ?",
+                    (key, time.time() - cls.TTL_S),
+                ).fetchone()
+            if row is not None:
+                cls._memory.set(key, row)
+                cls._count("shared_hits", row[1])
+                return row[0]
+
+        cls._count("misses")
+        return None
+
+
+    @classmethod
+    def set(cls, key: str, version: str, answer: str, total_tokens: int):
+        cls._memory.set(key, (answer, total_tokens))
+
+        connection = cls._shared()
+        if connection is None:
+            return
+
+        with cls._connection_lock:
+            connection.execute(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)",
+                (key, version, answer, total_tokens, time.time()),
+            )
+            # Once per index version per process: rows from older versions
+            # or past their TTL can never hit again.
+            if cls._pruned_version != version:
+                connection.execute(
+                    "DELETE FROM generations WHERE index_version != ? OR created_at <= ?",
+                    (version, time.time() - cls.TTL_S),
+                )
+                cls._pruned_version = version
+            connection.commit()
+
+
+    @classmethod
+    def stats(cls) -> Dict:
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+
+        lookups = stats["memory_hits"] + stats["shared_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["shared_hits"]
+        stats.update(
+            lookups=lookups,
+            hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+            memory_entries=len(cls._memory),
+            index_version=cls.index_version(),
+        )
+        return stats
@@ -0,0 +1,60 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medassist_backend_app.pipeline import ChatPipeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Answer a file of queries in bulk and write JSONL results. "
+        "Input is one query per line, or JSONL objects with a 'query' field."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Path to the queries file ('-' for stdin).")
+        parser.add_argument("--output", "-o", default="-", help="JSONL output path ('-' for stdout).")
+        parser.add_argument("--concurrency", type=int, default=None)
+
+    def read_queries(self, path: str):
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        queries = []
+
+        try:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    line = json.loads(line).get("query", "").strip()
+                if line:
+                    queries.append(line)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        return queries
+
+    def handle(self, *args, **options):
+        try:
+            queries = self.read_queries(options["input"])
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f"Could not read queries: {e}")
+
+        if not queries:
+            raise CommandError("No queries found.")
+
+        output = sys.stdout if options["output"] == "-" else open(options["output"], "w", encoding="utf-8")
+        failed = 0
+
+        try:
+            for result in ChatPipeline.answer_batch(queries, concurrency=options["concurrency"]):
+                failed += "error" in result
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        self.stderr.write(f"Answered {len(queries) - failed}/{len(queries)} queries.")
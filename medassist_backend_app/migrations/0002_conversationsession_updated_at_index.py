@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medassist_backend_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversationsession',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medassist_backend_app', '0002_conversationsession_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsession',
+            name='best_relevance',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -1,17 +1,17 @@
 import os
 from dotenv import load_dotenv
-from openai import AzureOpenAI
 from typing import List, Dict
 
-load_dotenv()
+from .azure_clients import build_openai_client, call_azure
+from .generation_cache import GenerationCache
 
 
 class FinalAnswerGenerator:
 
     AZURE_OPENAI_API_VERSION = "2024-06-01"
-    AZURE_OPENAI_CHAT_ENDPOINT = os.getenv("AZURE_OPENAI_CHAT_ENDPOINT")
-    AZURE_OPENAI_CHAT_KEY = os.getenv("AZURE_OPENAI_CHAT_KEY")
-    AZURE_OPENAI_CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
+    AZURE_OPENAI_CHAT_ENDPOINT = None
+    AZURE_OPENAI_CHAT_KEY = None
+    AZURE_OPENAI_CHAT_DEPLOYMENT = None
 
 
     UNSAFE_TERMS = [
@@ -20,11 +20,26 @@ class FinalAnswerGenerator:
     ]
 
 
-    chat_client = AzureOpenAI(
-        azure_endpoint=AZURE_OPENAI_CHAT_ENDPOINT,
-        api_key=AZURE_OPENAI_CHAT_KEY,
-        api_version=AZURE_OPENAI_API_VERSION,
-    )
+    chat_client = None
+
+
+    @classmethod
+    def get_chat_client(cls):
+        # Configured on first use rather than at import time.
+        if cls.chat_client is None:
+            load_dotenv()
+
+            cls.AZURE_OPENAI_CHAT_ENDPOINT = os.getenv("AZURE_OPENAI_CHAT_ENDPOINT")
+            cls.AZURE_OPENAI_CHAT_KEY = os.getenv("AZURE_OPENAI_CHAT_KEY")
+            cls.AZURE_OPENAI_CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
+
+            cls.chat_client = build_openai_client(
+                cls.AZURE_OPENAI_CHAT_ENDPOINT,
+                cls.AZURE_OPENAI_CHAT_KEY,
+                cls.AZURE_OPENAI_API_VERSION,
+            )
+
+        return cls.chat_client
 
 
     @classmethod
@@ -37,17 +52,42 @@ class FinalAnswerGenerator:
         cls,
         prompt_messages: List[Dict],
         temperature: float = 0.2,
-        max_tokens: int = 450
+        max_tokens: int = 450,
+        cache_key_messages: List[Dict] | None = None
     ) -> str:
 
-        response = cls.chat_client.chat.completions.create(
-            model=cls.AZURE_OPENAI_CHAT_DEPLOYMENT,
-            messages=prompt_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        chat_client = cls.get_chat_client()
+
+        # Callers may key the cache on a normalized form of the prompt.
+        cache_key = version = answer = None
+        if GenerationCache.enabled():
+            cache_key, version = GenerationCache.make_key(
+                cache_key_messages or prompt_messages,
+                cls.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                temperature,
+                max_tokens,
+            )
+            answer = GenerationCache.get(cache_key)
+
+        if answer is None:
+            response = call_azure(
+                "chat",
+                cls.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                lambda timeout: chat_client.chat.completions.create(
+                    model=cls.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                    messages=prompt_messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=timeout
+                )
+            )
+
+            answer = response.choices[0].message.content.strip()
 
-        answer = response.choices[0].message.content.strip()
+            # The raw answer is cached; the safety gate below runs on hits too.
+            if cache_key is not None and answer:
+                total_tokens = response.usage.total_tokens if response.usage else 0
+                GenerationCache.set(cache_key, version, answer, total_tokens)
 
         # Optional post-generation safety gate
         if cls.contains_unsafe_terms(answer):
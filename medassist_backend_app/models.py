@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class ConversationSession(models.Model):
+    session_id = models.CharField(max_length=64, primary_key=True)
+    # Last few turns as [{"query": ..., "answer": ...}], answers compacted.
+    turns = models.JSONField(default=list)
+    # Ids of the chunks retrieved for the latest turn.
+    chunk_ids = models.JSONField(default=list)
+    # Latest query embedding packed as float32.
+    query_embedding = models.BinaryField(null=True, blank=True)
+    # Best cosine similarity between that query and its chunks.
+    best_relevance = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Expired sessions are found (and purged) by this column.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.session_id
@@ -0,0 +1,372 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Tuple
+
+from .query_classifier import QueryClassifier
+from .retrieval import HybridRetriever
+from .evidence_conditioning import EvidenceConditioner
+from .rerank_and_context import MedicalReranker
+from .prompt_assembly import PromptAssembler
+from .model_generation import FinalAnswerGenerator
+from .diversity import CandidateDiversifier
+from .deadlines import deadline_scope, remaining_time
+from .session_store import SessionStore
+from .single_flight import SingleFlight, freeze_filters, normalize_query
+
+
+class ChatPipeline:
+    RETRIEVAL_TOP_K = 10
+    RERANK_TOP_K = 3
+    # Distinct candidates kept after near-duplicate suppression and MMR.
+    DIVERSE_TOP_K = 6
+
+    # Kept under the gunicorn worker timeout so requests fail fast instead
+    # of being killed mid-flight.
+    REQUEST_BUDGET_S = float(os.getenv("CHAT_REQUEST_BUDGET_S", "25"))
+
+    # Degraded mode: when less than this many seconds remain before a
+    # stage, it is skipped or shrunk so the request still finishes in time.
+    CLASSIFIER_LLM_MIN_BUDGET_S = 15.0
+    FULL_TOP_K_MIN_BUDGET_S = 12.0
+    RERANK_MIN_BUDGET_S = 10.0
+    FULL_MAX_TOKENS_MIN_BUDGET_S = 6.0
+
+    DEGRADED_TOP_K = 5
+    FOLLOW_UP_PREVIOUS_WEIGHT = 0.4
+    # A follow-up is first searched within the previous turn's chunks; a
+    # fresh search runs only if their best cosine match falls below this
+    # floor or below this fraction of the previous turn's best match.
+    FOLLOW_UP_MIN_RELEVANCE = float(os.getenv("CHAT_FOLLOW_UP_MIN_RELEVANCE", "0.4"))
+    FOLLOW_UP_MIN_RELATIVE_RELEVANCE = 0.9
+    MAX_TOKENS = 450
+    DEGRADED_MAX_TOKENS = 200
+
+    # Throughput of batch runs is bounded by the per-deployment limits in
+    # azure_clients. Over HTTP the whole batch shares one request budget,
+    # so it stays small enough to finish within the worker timeout; bulk
+    # runs go through ``manage.py chat_batch``, which has no deadline.
+    BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+    BATCH_HTTP_MAX_QUERIES = int(os.getenv("CHAT_BATCH_HTTP_MAX_QUERIES", "20"))
+
+    # Identical questions arriving together (e.g. after a health alert)
+    # share one retrieval -> rerank -> generation run.
+    _inflight = SingleFlight()
+
+
+    @classmethod
+    def warm_up(cls):
+        """
+        Imports the SDKs and builds the shared Azure clients (and the local
+        vector index, if configured) ahead of the first request. Nothing
+        does this at import time; call it explicitly, e.g. per worker.
+        """
+        retrieval = HybridRetriever()
+        retrieval.openai_client
+        retrieval.search_client
+        retrieval.local_index()
+
+        QueryClassifier().chat_client
+        MedicalReranker().chat_client
+        FinalAnswerGenerator.get_chat_client()
+
+
+    @classmethod
+    def answer(
+        cls,
+        query: str,
+        filters: Dict | None = None,
+        budget_s: float | None = None,
+        session_id: str | None = None,
+        follow_up: bool | None = None
+    ) -> Dict:
+        """
+        Without a ``session_id`` the call is stateless. ``follow_up``
+        overrides the follow-up heuristic for session requests.
+        """
+        budget = cls.REQUEST_BUDGET_S if budget_s is None else min(budget_s, cls.REQUEST_BUDGET_S)
+
+        with deadline_scope(budget):
+            state = SessionStore.load(session_id) if session_id else None
+            conversation = None
+            if SessionStore.is_follow_up(query, state, explicit=follow_up):
+                conversation = cls._follow_up_context(query, state)
+
+            result, context = cls._classify_and_answer(
+                query, filters, conversation=conversation
+            )
+
+        if session_id:
+            SessionStore.record_turn(
+                session_id,
+                state,
+                query,
+                result["answer"],
+                context["chunk_ids"],
+                context["query_embedding"],
+                context["best_relevance"],
+            )
+            result = {**result, "session_id": session_id}
+
+        return result
+
+
+    @classmethod
+    def _follow_up_context(cls, query: str, state: Dict) -> Dict:
+        """
+        A follow-up ("what about for children?") is retrieved with the
+        previous question as context, preferring the previous candidate
+        chunks, and its embedding blends in the previous query embedding.
+        """
+        previous_query = state["turns"][-1]["query"]
+        conversation = {
+            "history": state["turns"],
+            "candidate_ids": state["chunk_ids"],
+            "retrieval_query": f"{previous_query} {query}",
+            "query_embedding": None,
+            "previous_relevance": state.get("best_relevance"),
+        }
+
+        previous_embedding = state["query_embedding"]
+        if previous_embedding:
+            current = HybridRetriever().embed_query(query)
+            w = cls.FOLLOW_UP_PREVIOUS_WEIGHT
+            blended = [w * p + (1 - w) * c for p, c in zip(previous_embedding, current)]
+            norm = sum(x * x for x in blended) ** 0.5 or 1.0
+            conversation["query_embedding"] = [x / norm for x in blended]
+
+        return conversation
+
+
+    @classmethod
+    def answer_batch(
+        cls,
+        queries: List[str],
+        filters: Dict | None = None,
+        concurrency: int | None = None,
+        budget_s: float | None = None
+    ) -> Iterator[Dict]:
+        """
+        Answers many queries, yielding one result per query as it completes
+        (not in input order; each result carries its ``index``). With
+        ``budget_s``, queries still unanswered when it runs out are yielded
+        as errors.
+        """
+        deadline = None if budget_s is None else time.monotonic() + budget_s
+
+        retrieval = HybridRetriever()
+        try:
+            with deadline_scope(budget_s):
+                embeddings = retrieval.embed_queries(queries)
+        except Exception:
+            # Fall back to embedding per query inside each worker.
+            embeddings = [None] * len(queries)
+
+        executor = ThreadPoolExecutor(
+            max_workers=concurrency or cls.BATCH_CONCURRENCY,
+            thread_name_prefix="chat-batch",
+        )
+        try:
+            futures = {
+                executor.submit(
+                    cls._answer_before, deadline, query, filters, embedding
+                ): (index, query)
+                for index, (query, embedding) in enumerate(zip(queries, embeddings))
+            }
+
+            for future in as_completed(futures):
+                index, query = futures[future]
+                try:
+                    result, _ = future.result()
+                except Exception as e:
+                    yield {"index": index, "query": query, "error": str(e)}
+                else:
+                    yield {"index": index, "query": query, **result}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    @classmethod
+    def _answer_before(
+        cls,
+        deadline: float | None,
+        query: str,
+        filters: Dict | None,
+        query_embedding: List[float] | None
+    ) -> Tuple[Dict, Dict]:
+        budget = None if deadline is None else deadline - time.monotonic()
+        with deadline_scope(budget):
+            return cls._classify_and_answer(query, filters, query_embedding)
+
+
+    @classmethod
+    def _classify_and_answer(
+        cls,
+        query: str,
+        filters: Dict | None,
+        query_embedding: List[float] | None = None,
+        conversation: Dict | None = None
+    ) -> Tuple[Dict, Dict]:
+        degradations = []
+
+        classifier = QueryClassifier()
+        allow_llm = not cls._low_budget(cls.CLASSIFIER_LLM_MIN_BUDGET_S)
+        flag = classifier.classify_query(query, allow_llm=allow_llm)
+        if not allow_llm and classifier.classify_query_rule_based(query) is None:
+            degradations.append("classifier_llm_skipped")
+
+        # Reused as seeds for keyword query expansion.
+        seed_terms = classifier.matched_terms(query)
+
+        if conversation is not None:
+            # Session-specific, so never shared with other requests.
+            result, context = cls._answer(
+                query, flag, filters, conversation=conversation, seed_terms=seed_terms
+            )
+        else:
+            key = (normalize_query(query), flag, freeze_filters(filters), cls._budget_tier())
+            result, context = cls._inflight.do(
+                key, cls._answer, query, flag, filters, query_embedding,
+                seed_terms=seed_terms
+            )
+
+        degradations += [d for d in result["degradations"] if d not in degradations]
+        return {**result, "degradations": degradations}, context
+
+
+    @staticmethod
+    def _low_budget(min_budget_s: float) -> bool:
+        remaining = remaining_time()
+        return remaining is not None and remaining < min_budget_s
+
+
+    @staticmethod
+    def _best_relevance(documents: List[Dict], query_embedding: List[float]) -> float:
+        # Hybrid scores are normalized per result set, so compare raw
+        # cosine similarity; keyword-only hits carry no vector.
+        return max(
+            (
+                CandidateDiversifier.cosine(query_embedding, d["embedding"])
+                for d in documents
+                if d.get("embedding")
+            ),
+            default=0.0,
+        )
+
+
+    @classmethod
+    def _budget_tier(cls) -> Tuple[bool, ...]:
+        # A shared run degrades on its leader's deadline, so only requests
+        # with a similar budget left may share one; a client sending a
+        # tight X-Request-Timeout must not degrade everyone else's answer.
+        return tuple(
+            cls._low_budget(threshold)
+            for threshold in (
+                cls.CLASSIFIER_LLM_MIN_BUDGET_S,
+                cls.FULL_TOP_K_MIN_BUDGET_S,
+                cls.RERANK_MIN_BUDGET_S,
+                cls.FULL_MAX_TOKENS_MIN_BUDGET_S,
+            )
+        )
+
+
+    @classmethod
+    def _answer(
+        cls,
+        query: str,
+        flag: str,
+        filters: Dict | None,
+        query_embedding: List[float] | None = None,
+        conversation: Dict | None = None,
+        seed_terms: List[str] | None = None
+    ) -> Tuple[Dict, Dict]:
+        """
+        Returns the public result and the retrieval context
+        (``chunk_ids``, ``query_embedding``, ``best_relevance``) kept for
+        session follow-ups.
+        """
+        degradations = []
+
+        top_k = cls.RETRIEVAL_TOP_K
+        if cls._low_budget(cls.FULL_TOP_K_MIN_BUDGET_S):
+            top_k = cls.DEGRADED_TOP_K
+            degradations.append("top_k_reduced")
+
+        retrieval_query = query
+        history = None
+        if conversation is not None:
+            retrieval_query = conversation["retrieval_query"]
+            history = conversation["history"]
+            query_embedding = conversation["query_embedding"]
+
+        retrieval = HybridRetriever()
+        documents = None
+        if conversation is not None and conversation["candidate_ids"]:
+            previous, query_embedding = retrieval.hybrid_retrieval(
+                retrieval_query,
+                top_k=top_k,
+                filters=filters,
+                search_k=top_k,
+                query_embedding=query_embedding,
+                seed_terms=seed_terms,
+                candidate_ids=conversation["candidate_ids"],
+            )
+            # Stay on the previous chunks while they still match about as
+            # well as they did last turn; otherwise the topic has moved on.
+            relevance = cls._best_relevance(previous, query_embedding)
+            floor = max(
+                cls.FOLLOW_UP_MIN_RELEVANCE,
+                cls.FOLLOW_UP_MIN_RELATIVE_RELEVANCE * (conversation["previous_relevance"] or 0.0),
+            )
+            if previous and relevance >= floor:
+                documents = previous
+
+        if documents is None:
+            documents, query_embedding = retrieval.hybrid_retrieval(
+                retrieval_query,
+                top_k=top_k,
+                filters=filters,
+                search_k=top_k,
+                query_embedding=query_embedding,
+                seed_terms=seed_terms,
+            )
+
+        evidence_docs = EvidenceConditioner.prepare_llm_context(
+            CandidateDiversifier.diversify(documents, cls.DIVERSE_TOP_K)
+        )
+
+        if cls._low_budget(cls.RERANK_MIN_BUDGET_S):
+            # Evidence is already in relevance (MMR) order.
+            reranked_chunks = evidence_docs[:cls.RERANK_TOP_K]
+            degradations.append("rerank_skipped")
+        else:
+            rerank = MedicalReranker()
+            reranked_chunks = rerank.medical_rerank(
+                query, evidence_docs, top_k=cls.RERANK_TOP_K
+            )
+        final_context = MedicalReranker.build_context(reranked_chunks)
+
+        prompt = PromptAssembler.assemble_prompt(
+            query, evidence_docs, flag, history=history
+        )
+
+        max_tokens = cls.MAX_TOKENS
+        if cls._low_budget(cls.FULL_MAX_TOKENS_MIN_BUDGET_S):
+            max_tokens = cls.DEGRADED_MAX_TOKENS
+            degradations.append("max_tokens_reduced")
+
+        # Cached under the same prompt built from the normalized question,
+        # so trivially different repeats share a generation.
+        cache_key_messages = PromptAssembler.assemble_prompt(
+            normalize_query(query), evidence_docs, flag, history=history
+        )
+        final_answer = FinalAnswerGenerator.generate_final_answer(
+            prompt, max_tokens=max_tokens, cache_key_messages=cache_key_messages
+        )
+
+        context = {
+            "chunk_ids": [d["id"] for d in documents],
+            "query_embedding": query_embedding,
+            "best_relevance": cls._best_relevance(documents, query_embedding),
+        }
+        return {"answer": final_answer, "degradations": degradations}, context
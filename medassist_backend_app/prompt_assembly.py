@@ -27,6 +27,26 @@ Answer Guidelines:
 - If recommendations vary, mention the variation
 """
 
+    # Conversation history is trimmed to roughly this many tokens,
+    # keeping the most recent turns.
+    HISTORY_TOKEN_BUDGET = 300
+    CHARS_PER_TOKEN = 4
+
+    # ------------------------------------------------
+    @classmethod
+    def build_history_block(cls, history: List[Dict]) -> str:
+        budget = cls.HISTORY_TOKEN_BUDGET * cls.CHARS_PER_TOKEN
+        turns = []
+
+        for turn in reversed(history):
+            text = f"User: {turn['query']}\nMedAssist: {turn['answer']}"
+            if len(text) > budget:
+                break
+            turns.append(text)
+            budget -= len(text)
+
+        return "\n\n".join(reversed(turns))
+
     # ------------------------------------------------
     @classmethod
     def build_task_instruction(cls, user_query: str) -> str:
@@ -56,9 +76,18 @@ Question:
         cls,
         user_query: str,
         evidence_chunks: List[Dict],
-        flag: str
+        flag: str,
+        history: List[Dict] | None = None
     ) -> List[Dict]:
 
+        history_block = cls.build_history_block(history) if history else ""
+        if history_block:
+            history_block = (
+                "Conversation so far (context only, not evidence):\n"
+                + history_block
+                + "\n"
+            )
+
         return [
             {
                 "role": "system",
@@ -67,7 +96,8 @@ Question:
             {
                 "role": "user",
                 "content": (
-                    cls.build_task_instruction(user_query)
+                    history_block
+                    + cls.build_task_instruction(user_query)
                     + "\n\nEvidence:\n"
                     + cls.build_evidence_block(evidence_chunks)
                     + "\n\n"
@@ -0,0 +1,246 @@
+import heapq
+import json
+import mmap
+import os
+import shutil
+import time
+from array import array
+from operator import mul
+from typing import Dict, Iterator, List, Tuple
+
+
+QUANTIZATION_MODES = ("binary", "int8")
+
+
+# ============================================================
+# Vector transforms
+# ============================================================
+def normalize(vector: List[float]) -> List[float]:
+    norm = sum(x * x for x in vector) ** 0.5 or 1.0
+    return [x / norm for x in vector]
+
+
+def truncate_embedding(vector: List[float], dimensions: int | None) -> List[float]:
+    """
+    Matryoshka-style truncation: keep the leading dimensions and
+    re-normalize. Only meaningful for models trained for it
+    (text-embedding-3-*); ingestion and queries must use the same value.
+    """
+    if not dimensions or dimensions >= len(vector):
+        return vector
+    return normalize(vector[:dimensions])
+
+
+def quantize_binary(vector: List[float]) -> int:
+    code = 0
+    for i, x in enumerate(vector):
+        if x > 0:
+            code |= 1 << i
+    return code
+
+
+def quantize_int8(vector: List[float]) -> Tuple[array, float]:
+    scale = max((abs(x) for x in vector), default=0.0) / 127 or 1.0
+    return array("b", (round(x / scale) for x in vector)), scale
+
+
+def dot(a, b) -> float:
+    return sum(map(mul, a, b))
+
+
+# ============================================================
+# Local two-stage index
+# ============================================================
+class LocalVectorIndex:
+    """
+    In-process vector index: compact quantized codes stay in memory for a
+    coarse top-N scan, full-precision float32 vectors stay on disk
+    (memory-mapped) and are only read to rescore those N candidates.
+
+    On disk the index is a directory with ``meta.json`` and one
+    ``data-<version>`` subdirectory per save holding ``codes.bin``,
+    ``scales.f32`` (int8 only) and ``vectors.f32``. A save writes a new
+    subdirectory and then swaps ``meta.json`` (ids plus the version) with a
+    single rename, so a concurrent load sees either the old index or the
+    new one, never a mix.
+    """
+
+    DEFAULT_RESCORE_CANDIDATES = 50
+
+    def __init__(self, dimensions: int, mode: str = "binary"):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+
+        self.dimensions = dimensions
+        self.mode = mode
+        self.ids: List[str] = []
+        self._binary_codes: List[int] = []
+        self._int8_codes = array("b")
+        self._int8_scales = array("f")
+        self._vectors = array("f")
+        self._mapped = None
+        self._file = None
+
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+    def add(self, doc_id: str, vector: List[float]):
+        if len(vector) != self.dimensions:
+            raise ValueError(
+                f"Expected {self.dimensions} dimensions, got {len(vector)}"
+            )
+        if self._mapped is not None:
+            raise RuntimeError("Index was loaded read-only; rebuild it to add vectors.")
+
+        self.ids.append(doc_id)
+        if self.mode == "binary":
+            self._binary_codes.append(quantize_binary(vector))
+        else:
+            codes, scale = quantize_int8(vector)
+            self._int8_codes.extend(codes)
+            self._int8_scales.append(scale)
+        self._vectors.extend(vector)
+
+
+    def vector(self, position: int) -> List[float]:
+        start = position * self.dimensions
+        return list(self._full_vectors()[start:start + self.dimensions])
+
+
+    def items(self) -> Iterator[Tuple[str, List[float]]]:
+        for position, doc_id in enumerate(self.ids):
+            yield doc_id, self.vector(position)
+
+
+    def code_bytes(self) -> int:
+        if self.mode == "binary":
+            return len(self.ids) * ((self.dimensions + 7) // 8)
+        return len(self._int8_codes) + len(self._int8_scales) * 4
+
+
+    def _full_vectors(self):
+        return self._mapped if self._mapped is not None else self._vectors
+
+
+    def _coarse(self, query: List[float], n: int) -> List[int]:
+        if self.mode == "binary":
+            q = quantize_binary(query)
+            distances = [(q ^ code).bit_count() for code in self._binary_codes]
+            return heapq.nsmallest(n, range(len(distances)), key=distances.__getitem__)
+
+        q, _ = quantize_int8(query)
+        d = self.dimensions
+        codes = self._int8_codes
+        scores = [
+            dot(q, codes[i * d:(i + 1) * d]) * self._int8_scales[i]
+            for i in range(len(self.ids))
+        ]
+        return heapq.nlargest(n, range(len(scores)), key=scores.__getitem__)
+
+
+    def search(
+        self,
+        query: List[float],
+        k: int = 10,
+        rescore_candidates: int | None = None
+    ) -> List[Dict]:
+        query = truncate_embedding(query, self.dimensions)
+        n = max(k, rescore_candidates or self.DEFAULT_RESCORE_CANDIDATES)
+
+        hits = []
+        for position in self._coarse(query, n):
+            vector = self.vector(position)
+            hits.append({
+                "id": self.ids[position],
+                "score": dot(query, vector),
+                "embedding": vector,
+            })
+
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[:k]
+
+
+    # ------------------------------------------------
+    @staticmethod
+    def _read_meta(path: str) -> Dict | None:
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        previous = self._read_meta(path)
+
+        version = f"data-{time.time_ns()}"
+        data_path = os.path.join(path, version)
+        os.makedirs(data_path)
+
+        with open(os.path.join(data_path, "codes.bin"), "wb") as f:
+            if self.mode == "binary":
+                width = (self.dimensions + 7) // 8
+                for code in self._binary_codes:
+                    f.write(code.to_bytes(width, "little"))
+            else:
+                self._int8_codes.tofile(f)
+        if self.mode == "int8":
+            with open(os.path.join(data_path, "scales.f32"), "wb") as f:
+                self._int8_scales.tofile(f)
+        with open(os.path.join(data_path, "vectors.f32"), "wb") as f:
+            array("f", self._full_vectors()).tofile(f)
+
+        # The rename of meta.json is the switch to the new version.
+        target = os.path.join(path, "meta.json")
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "dimensions": self.dimensions,
+                "mode": self.mode,
+                "version": version,
+                "ids": self.ids,
+            }, f)
+        os.replace(target + ".tmp", target)
+
+        # Keep the previous version for loads that read the old meta.json
+        # just before the switch; processes that already mapped older files
+        # keep them until they reload.
+        keep = {version, previous.get("version") if previous else None}
+        for name in os.listdir(path):
+            if name.startswith("data-") and name not in keep:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+    @classmethod
+    def load(cls, path: str) -> "LocalVectorIndex":
+        meta = cls._read_meta(path)
+        if meta is None:
+            raise FileNotFoundError(f"No local vector index at {path}")
+
+        index = cls(meta["dimensions"], meta["mode"])
+        index.ids = meta["ids"]
+        # Indexes saved before versioning keep their files next to meta.json.
+        path = os.path.join(path, meta.get("version", ""))
+
+        with open(os.path.join(path, "codes.bin"), "rb") as f:
+            raw = f.read()
+        if index.mode == "binary":
+            width = (index.dimensions + 7) // 8
+            index._binary_codes = [
+                int.from_bytes(raw[i:i + width], "little")
+                for i in range(0, len(raw), width)
+            ]
+        else:
+            index._int8_codes.frombytes(raw)
+            with open(os.path.join(path, "scales.f32"), "rb") as f:
+                index._int8_scales.frombytes(f.read())
+
+        if index.ids:
+            index._file = open(os.path.join(path, "vectors.f32"), "rb")
+            index._mapped = memoryview(
+                mmap.mmap(index._file.fileno(), 0, access=mmap.ACCESS_READ)
+            ).cast("f")
+
+        return index
@@ -1,9 +1,14 @@
 import os
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from typing import List
+
+from .azure_clients import build_openai_client, call_azure
+from .single_flight import SingleFlight, normalize_query
 
 
 class QueryClassifier:
+    _inflight = SingleFlight()
+
     def __init__(self):
         load_dotenv()
 
@@ -12,12 +17,6 @@ class QueryClassifier:
         self.AZURE_OPENAI_CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
         self.AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 
-        self.chat_client = AzureOpenAI(
-            azure_endpoint=self.AZURE_OPENAI_CHAT_ENDPOINT,
-            api_key=self.AZURE_OPENAI_CHAT_KEY,
-            api_version=self.AZURE_OPENAI_API_VERSION,
-        )
-
         self.EMERGENCY_TERMS = [
             "chest pain", "shortness of breath", "difficulty breathing",
             "loss of consciousness", "seizure", "severe bleeding",
@@ -48,6 +47,15 @@ class QueryClassifier:
             "explain", "define", "treatments"
         ]
 
+    @property
+    def chat_client(self):
+        # Built on first LLM call and shared across instances.
+        return build_openai_client(
+            self.AZURE_OPENAI_CHAT_ENDPOINT,
+            self.AZURE_OPENAI_CHAT_KEY,
+            self.AZURE_OPENAI_API_VERSION,
+        )
+
     def classify_query_rule_based(self, query: str) -> str | None:
         q = query.lower()
 
@@ -71,7 +79,22 @@ class QueryClassifier:
 
         return None
 
+    def matched_terms(self, query: str) -> List[str]:
+        q = query.lower()
+        term_lists = (
+            self.EMERGENCY_TERMS, self.DIET_TERMS, self.LIFESTYLE_TERMS,
+            self.DISEASE_TERMS, self.SYMPTOM_TERMS
+        )
+        return [term for terms in term_lists for term in terms if term in q]
+
     def classify_query_llm(self, query: str) -> str | None:
+        return self._inflight.do(
+            ("intent", self.AZURE_OPENAI_CHAT_DEPLOYMENT, normalize_query(query)),
+            self._classify_query_llm,
+            query,
+        )
+
+    def _classify_query_llm(self, query: str) -> str | None:
         INTENT_SYSTEM_PROMPT = """
 You are a medical query classifier.
 
@@ -92,23 +115,31 @@ Rules:
   classify it as "emergency_flag"
 """
 
-        response = self.chat_client.chat.completions.create(
-            model=self.AZURE_OPENAI_CHAT_DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": INTENT_SYSTEM_PROMPT},
-                {"role": "user", "content": query}
-            ],
-            temperature=0
+        response = call_azure(
+            "chat",
+            self.AZURE_OPENAI_CHAT_DEPLOYMENT,
+            lambda timeout: self.chat_client.chat.completions.create(
+                model=self.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                messages=[
+                    {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+                    {"role": "user", "content": query}
+                ],
+                temperature=0,
+                timeout=timeout
+            )
         )
 
         content = response.choices[0].message.content
         return content.strip().lower() if content else None
 
-    def classify_query(self, query: str) -> str:
+    def classify_query(self, query: str, allow_llm: bool = True) -> str:
         rule_intent = self.classify_query_rule_based(query)
 
         if rule_intent:
             return rule_intent
 
+        if not allow_llm:
+            return "general_education"
+
         llm_intent = self.classify_query_llm(query)
         return llm_intent if llm_intent else "unknown"
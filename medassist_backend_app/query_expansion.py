@@ -0,0 +1,127 @@
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+
+class MedicalSynonymIndex:
+    """
+    Phrase -> weighted expansions, keyed by token tuples so lookup is a
+    hash probe per candidate phrase length. Loaded once per process.
+    """
+
+    DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "data", "medical_synonyms.tsv")
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, entries: Dict[Tuple[str, ...], List[Tuple[str, float]]]):
+        self.entries = entries
+        self.max_phrase_len = max((len(k) for k in entries), default=0)
+
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+
+    @classmethod
+    def from_file(cls, path: str) -> "MedicalSynonymIndex":
+        entries = defaultdict(list)
+
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                term, expansion, weight = line.split("\t")
+                entries[tuple(cls.tokenize(term))].append((expansion, float(weight)))
+
+        return cls(dict(entries))
+
+
+    @classmethod
+    def get(cls) -> "MedicalSynonymIndex":
+        with cls._lock:
+            if cls._instance is None:
+                path = os.getenv("MEDICAL_SYNONYMS_PATH") or cls.DEFAULT_PATH
+                cls._instance = cls.from_file(path)
+            return cls._instance
+
+
+    def lookup(self, term: str) -> List[Tuple[str, float]]:
+        return self.entries.get(tuple(self.tokenize(term)), [])
+
+
+    def find_terms(self, text: str) -> List[str]:
+        """Greedy longest-match scan of the text for known phrases."""
+        tokens = self.tokenize(text)
+        found = []
+        i = 0
+
+        while i < len(tokens):
+            for n in range(min(self.max_phrase_len, len(tokens) - i), 0, -1):
+                phrase = tuple(tokens[i:i + n])
+                if phrase in self.entries:
+                    found.append(" ".join(phrase))
+                    i += n
+                    break
+            else:
+                i += 1
+
+        return found
+
+
+class QueryExpander:
+    MAX_EXPANSIONS = 8
+
+    # Lucene full-syntax operators that must be escaped in user text.
+    LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+    # Uppercase boolean words are operators too; lower-cased they are
+    # plain terms.
+    LUCENE_OPERATORS = re.compile(r"\b(AND|OR|NOT)\b")
+
+
+    @classmethod
+    def escape(cls, text: str) -> str:
+        text = cls.LUCENE_SPECIAL.sub(r"\\\1", text)
+        return cls.LUCENE_OPERATORS.sub(lambda m: m.group(1).lower(), text)
+
+
+    @classmethod
+    def expansions(cls, query: str, seed_terms: List[str] | None = None) -> List[Tuple[str, float]]:
+        index = MedicalSynonymIndex.get()
+        query_tokens = set(index.tokenize(query))
+
+        # Terms the classifier already matched are looked up directly; the
+        # scan picks up everything else in the index.
+        terms = list(seed_terms or []) + index.find_terms(query)
+
+        best: Dict[str, float] = {}
+        for term in terms:
+            for expansion, weight in index.lookup(term):
+                # Nothing to add if the user already used these words.
+                if set(index.tokenize(expansion)) <= query_tokens:
+                    continue
+                best[expansion] = max(weight, best.get(expansion, 0.0))
+
+        ranked = sorted(best.items(), key=lambda e: e[1], reverse=True)
+        return ranked[:cls.MAX_EXPANSIONS]
+
+
+    @classmethod
+    def expand(cls, query: str, seed_terms: List[str] | None = None) -> str | None:
+        """
+        Returns a Lucene (queryType=full) query that keeps the user's words
+        and ORs in boosted synonyms, or None when nothing applies.
+        """
+        expansions = cls.expansions(query, seed_terms)
+        if not expansions:
+            return None
+
+        clauses = [f"({cls.escape(query)})"]
+        for expansion, weight in expansions:
+            clauses.append(f'"{cls.escape(expansion)}"^{weight:g}')
+
+        return " OR ".join(clauses)
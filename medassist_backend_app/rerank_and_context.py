@@ -1,7 +1,8 @@
 import os
 from dotenv import load_dotenv
 from typing import List, Dict
-from openai import AzureOpenAI
+
+from .azure_clients import build_openai_client, call_azure
 
 
 class MedicalReranker:
@@ -13,14 +14,15 @@ class MedicalReranker:
         self.AZURE_OPENAI_CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
         self.AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 
-
-        self.chat_client = AzureOpenAI(
-            azure_endpoint=self.AZURE_OPENAI_CHAT_ENDPOINT,
-            api_key=self.AZURE_OPENAI_CHAT_KEY,
-            api_version=self.AZURE_OPENAI_API_VERSION,
+    @property
+    def chat_client(self):
+        # Built on first LLM call and shared across instances.
+        return build_openai_client(
+            self.AZURE_OPENAI_CHAT_ENDPOINT,
+            self.AZURE_OPENAI_CHAT_KEY,
+            self.AZURE_OPENAI_API_VERSION,
         )
 
-
     def medical_rerank(
         self,
         query: str,
@@ -45,22 +47,29 @@ Text:
 Respond with ONLY a number from 0 to 10.
 """
 
-            response = self.chat_client.chat.completions.create(
-                model=self.AZURE_OPENAI_CHAT_DEPLOYMENT,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a strict medical relevance evaluator. "
-                            "Respond with only a number."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0
+            messages = [
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a strict medical relevance evaluator. "
+                        "Respond with only a number."
+                    )
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+
+            response = call_azure(
+                "chat",
+                self.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                lambda timeout: self.chat_client.chat.completions.create(
+                    model=self.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                    messages=messages,
+                    temperature=0,
+                    timeout=timeout
+                )
             )
 
             score_text = response.choices[0].message.content.strip()
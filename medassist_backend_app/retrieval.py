@@ -1,13 +1,41 @@
+import contextvars
 import os
+import threading
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-from openai import AzureOpenAI
+from .azure_clients import (
+    build_openai_client,
+    build_search_client,
+    call_azure,
+    search_timeouts,
+)
+from .query_expansion import QueryExpander
+from .quantization import LocalVectorIndex, truncate_embedding
+from .single_flight import SingleFlight
 
 
 class HybridRetriever:
+    EMBED_BATCH_SIZE = 64
+
+    # Filterable index fields and the JSON type each accepts; anything else
+    # in a request's filters is rejected before it reaches OData.
+    FILTER_FIELDS = {"source": str, "year": int}
+
+    # Shared across instances so concurrent requests collapse identical
+    # embedding and search calls into a single Azure round trip.
+    _inflight = SingleFlight()
+
+    # Runs keyword search alongside embedding + vector search; created on
+    # first use like the hedge pool in azure_clients.
+    _search_pool = None
+    _search_pool_lock = threading.Lock()
+
+    # Local quantized indexes per path, with the meta.json mtime they were
+    # loaded at; a re-ingest rewrites meta.json last, which triggers a reload.
+    _local_indexes: Dict[str, Tuple[int, LocalVectorIndex]] = {}
+    _local_indexes_lock = threading.Lock()
+
     def __init__(self):
         load_dotenv()
 
@@ -20,38 +48,196 @@ class HybridRetriever:
         self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
         self.AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 
-       
-        self.search_client = SearchClient(
-            endpoint=self.AZURE_SEARCH_ENDPOINT,
-            index_name=self.AZURE_SEARCH_INDEX,
-            credential=AzureKeyCredential(self.AZURE_SEARCH_KEY),
+        # Must match the values used by ingest.py.
+        self.EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
+        self.LOCAL_VECTOR_INDEX = os.getenv("LOCAL_VECTOR_INDEX")
+        self.QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "1") != "0"
+        # Only indexes created with a ``simhash`` field may select it;
+        # without it signatures are computed from the text.
+        self.SIMHASH_FIELD = os.getenv("SEARCH_SIMHASH_FIELD", "0") == "1"
+
+    def _select(self, *fields: str) -> List[str]:
+        return [*fields, "simhash"] if self.SIMHASH_FIELD else list(fields)
+
+    # Clients are built on first use and shared across instances.
+    @property
+    def search_client(self):
+        return build_search_client(
+            self.AZURE_SEARCH_ENDPOINT,
+            self.AZURE_SEARCH_INDEX,
+            self.AZURE_SEARCH_KEY,
         )
 
-        self.openai_client = AzureOpenAI(
-            azure_endpoint=self.AZURE_OPENAI_EMBEDDING_ENDPOINT,
-            api_key=self.AZURE_OPENAI_EMBEDDING_KEY,
-            api_version=self.AZURE_OPENAI_API_VERSION,
+    @property
+    def openai_client(self):
+        return build_openai_client(
+            self.AZURE_OPENAI_EMBEDDING_ENDPOINT,
+            self.AZURE_OPENAI_EMBEDDING_KEY,
+            self.AZURE_OPENAI_API_VERSION,
         )
 
-    
+
+    @classmethod
+    def validate_filters(cls, filters) -> Dict:
+        if filters is None:
+            return {}
+        if not isinstance(filters, dict):
+            raise ValueError("'filters' must be an object.")
+
+        for field, value in filters.items():
+            expected = cls.FILTER_FIELDS.get(field)
+            if expected is None:
+                raise ValueError(
+                    f"Unknown filter field {field!r}; allowed: {', '.join(sorted(cls.FILTER_FIELDS))}."
+                )
+            # bool is an int subclass but never a valid year.
+            if not isinstance(value, expected) or isinstance(value, bool):
+                raise ValueError(f"Filter {field!r} must be a {expected.__name__}.")
+
+        return filters
+
+
+    @classmethod
+    def build_filter(
+        cls,
+        filters: Dict | None,
+        candidate_ids: List[str] | None = None
+    ) -> str | None:
+        clauses = []
+
+        if candidate_ids:
+            # Ids are URL-safe base64, so they never contain the delimiter.
+            clauses.append(f"search.in(id, '{','.join(candidate_ids)}', ',')")
+
+        filters = cls.validate_filters(filters)
+        for field, value in sorted(filters.items()):
+            if isinstance(value, str):
+                escaped = value.replace("'", "''")
+                clauses.append(f"{field} eq '{escaped}'")
+            else:
+                clauses.append(f"{field} eq {value}")
+
+        return " and ".join(clauses) or None
+
+
+    @classmethod
+    def _get_search_pool(cls):
+        with cls._search_pool_lock:
+            if cls._search_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                cls._search_pool = ThreadPoolExecutor(
+                    max_workers=32, thread_name_prefix="keyword-search"
+                )
+            return cls._search_pool
+
+
+    def local_index(self) -> LocalVectorIndex | None:
+        path = self.LOCAL_VECTOR_INDEX
+        if not path:
+            return None
+
+        # Not built yet (e.g. before the first ingest): use Azure vector
+        # search until it appears.
+        try:
+            mtime = os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._local_indexes_lock:
+            loaded_mtime, index = self._local_indexes.get(path, (None, None))
+            if loaded_mtime != mtime:
+                # Searches still holding the old index keep their mapping.
+                index = LocalVectorIndex.load(path)
+                self._local_indexes[path] = (mtime, index)
+            return index
+
+
     def embed_query(self, query: str) -> List[float]:
-        response = self.openai_client.embeddings.create(
-            model=self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
-            input=query,
+        return self._inflight.do(
+            ("embed", self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT, query.strip()),
+            self._embed_query,
+            query,
+        )
+
+    def _embed_query(self, query: str) -> List[float]:
+        response = call_azure(
+            "embedding",
+            self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+            lambda timeout: self.openai_client.embeddings.create(
+                model=self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+                input=query,
+                timeout=timeout,
+            ),
+            hedge=True,
         )
-        return response.data[0].embedding
+        return truncate_embedding(response.data[0].embedding, self.EMBEDDING_DIMENSIONS)
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        embeddings = []
+
+        for start in range(0, len(queries), self.EMBED_BATCH_SIZE):
+            batch = queries[start:start + self.EMBED_BATCH_SIZE]
+            response = call_azure(
+                "embedding",
+                self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+                lambda timeout: self.openai_client.embeddings.create(
+                    model=self.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+                    input=batch,
+                    timeout=timeout,
+                ),
+            )
+            ordered = sorted(response.data, key=lambda d: d.index)
+            embeddings.extend(
+                truncate_embedding(d.embedding, self.EMBEDDING_DIMENSIONS)
+                for d in ordered
+            )
+
+        return embeddings
 
     
-    def vector_search(self, query_embedding: List[float], k: int = 10) -> Dict[str, Dict]:
-        results = self.search_client.search(
-            search_text=None,
-            vector_queries=[{
-                "kind": "vector",
-                "vector": query_embedding,
-                "fields": "contentVector",
-                "k": k
-            }],
-            select=["id", "content", "contentVector", "source", "year"]
+    def vector_search(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        filters: Dict | None = None,
+        candidate_ids: List[str] | None = None
+    ) -> Dict[str, Dict]:
+        odata_filter = self.build_filter(filters, candidate_ids)
+        return self._inflight.do(
+            ("vector", self.AZURE_SEARCH_INDEX, tuple(query_embedding), k, odata_filter),
+            self._vector_search,
+            query_embedding,
+            k,
+            odata_filter,
+        )
+
+    def _vector_search(
+        self,
+        query_embedding: List[float],
+        k: int,
+        odata_filter: str | None
+    ) -> Dict[str, Dict]:
+        index = self.local_index()
+        if index is not None and odata_filter is None:
+            return self._local_vector_search(index, query_embedding, k)
+
+        results = call_azure(
+            "search",
+            self.AZURE_SEARCH_INDEX,
+            lambda timeout: list(self.search_client.search(
+                search_text=None,
+                vector_queries=[{
+                    "kind": "vector",
+                    "vector": query_embedding,
+                    "fields": "contentVector",
+                    "k": k
+                }],
+                filter=odata_filter,
+                select=self._select("id", "content", "contentVector", "source", "year"),
+                **search_timeouts(timeout)
+            )),
+            hedge=True,
         )
 
         vector_hits = {}
@@ -61,17 +247,118 @@ class HybridRetriever:
                 "embedding": r["contentVector"],
                 "vector_score": r["@search.score"],
                 "source": r.get("source"),
-                "year": r.get("year")
+                "year": r.get("year"),
+                "simhash": r.get("simhash")
+            }
+
+        return vector_hits
+
+    def _local_vector_search(
+        self,
+        index: LocalVectorIndex,
+        query_embedding: List[float],
+        k: int
+    ) -> Dict[str, Dict]:
+        # Two-stage search happens locally (quantized top-N, exact rescore);
+        # Azure only returns content for the final ids, without vectors.
+        hits = index.search(query_embedding, k=k)
+        if not hits:
+            return {}
+
+        results = call_azure(
+            "search",
+            self.AZURE_SEARCH_INDEX,
+            lambda timeout: list(self.search_client.search(
+                search_text="*",
+                filter=self.build_filter(None, [h["id"] for h in hits]),
+                top=len(hits),
+                select=self._select("id", "content", "source", "year"),
+                **search_timeouts(timeout)
+            )),
+            hedge=True,
+        )
+        documents = {r["id"]: r for r in results}
+
+        vector_hits = {}
+        for h in hits:
+            r = documents.get(h["id"])
+            if r is None:
+                continue
+            vector_hits[h["id"]] = {
+                "text": r["content"],
+                "embedding": h["embedding"],
+                "vector_score": h["score"],
+                "source": r.get("source"),
+                "year": r.get("year"),
+                "simhash": r.get("simhash")
             }
 
         return vector_hits
 
     
-    def keyword_search(self, query: str, k: int = 10) -> Dict[str, Dict]:
-        results = self.search_client.search(
-            search_text=query,
-            top=k,
-            select=["id", "content", "source", "year"]
+    def keyword_search(
+        self,
+        query: str,
+        k: int = 10,
+        filters: Dict | None = None,
+        candidate_ids: List[str] | None = None,
+        seed_terms: List[str] | None = None
+    ) -> Dict[str, Dict]:
+        odata_filter = self.build_filter(filters, candidate_ids)
+
+        # Lay terms ("heart attack") are expanded with weighted guideline
+        # vocabulary ("myocardial infarction") for BM25.
+        search_text, query_type = query.strip(), "simple"
+        if self.QUERY_EXPANSION:
+            expanded = QueryExpander.expand(search_text, seed_terms)
+            if expanded:
+                search_text, query_type = expanded, "full"
+
+        try:
+            return self._shared_keyword_search(search_text, query_type, k, odata_filter)
+        except Exception as e:
+            # Never fail a request over an expanded query Azure cannot
+            # parse; the user's own words with the simple syntax still work.
+            if query_type != "full" or getattr(e, "status_code", None) != 400:
+                raise
+
+        return self._shared_keyword_search(query.strip(), "simple", k, odata_filter)
+
+    def _shared_keyword_search(
+        self,
+        search_text: str,
+        query_type: str,
+        k: int,
+        odata_filter: str | None
+    ) -> Dict[str, Dict]:
+        return self._inflight.do(
+            ("keyword", self.AZURE_SEARCH_INDEX, search_text, query_type, k, odata_filter),
+            self._keyword_search,
+            search_text,
+            query_type,
+            k,
+            odata_filter,
+        )
+
+    def _keyword_search(
+        self,
+        search_text: str,
+        query_type: str,
+        k: int,
+        odata_filter: str | None
+    ) -> Dict[str, Dict]:
+        results = call_azure(
+            "search",
+            self.AZURE_SEARCH_INDEX,
+            lambda timeout: list(self.search_client.search(
+                search_text=search_text,
+                query_type=query_type,
+                top=k,
+                filter=odata_filter,
+                select=self._select("id", "content", "source", "year"),
+                **search_timeouts(timeout)
+            )),
+            hedge=True,
         )
 
         keyword_hits = {}
@@ -80,18 +367,48 @@ class HybridRetriever:
                 "text": r["content"],
                 "bm25_score": r["@search.score"],
                 "source": r.get("source"),
-                "year": r.get("year")
+                "year": r.get("year"),
+                "simhash": r.get("simhash")
             }
 
         return keyword_hits
 
     
-    def hybrid_retrieval(self, query: str, top_k: int = 5) -> List[Dict]:
+    def hybrid_retrieval(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Dict | None = None,
+        search_k: int = 10,
+        query_embedding: List[float] | None = None,
+        candidate_ids: List[str] | None = None,
+        seed_terms: List[str] | None = None
+    ) -> Tuple[List[Dict], List[float]]:
+        """
+        Returns the merged results and the query embedding used, so callers
+        that need it (sessions) don't embed the query a second time.
+        """
 
-        query_embedding = self.embed_query(query)
+        # Keyword search needs no embedding, so it starts first and overlaps
+        # with embedding + vector search. The copied context carries the
+        # request deadline into the pool thread.
+        keyword_future = self._get_search_pool().submit(
+            contextvars.copy_context().run,
+            self.keyword_search,
+            query,
+            k=search_k,
+            filters=filters,
+            candidate_ids=candidate_ids,
+            seed_terms=seed_terms,
+        )
+
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
 
-        vector_results = self.vector_search(query_embedding)
-        keyword_results = self.keyword_search(query)
+        vector_results = self.vector_search(
+            query_embedding, k=search_k, filters=filters, candidate_ids=candidate_ids
+        )
+        keyword_results = keyword_future.result()
 
         all_doc_ids = set(vector_results) | set(keyword_results)
 
@@ -121,8 +438,9 @@ class HybridRetriever:
                 "embedding": v.get("embedding"),
                 "source": v.get("source") or k.get("source"),
                 "year": v.get("year") or k.get("year"),
+                "simhash": v.get("simhash") or k.get("simhash"),
                 "score": hybrid_score
             })
 
         merged.sort(key=lambda x: x["score"], reverse=True)
-        return merged[:top_k]
\ No newline at end of file
+        return merged[:top_k], query_embedding
\ No newline at end of file
@@ -0,0 +1,175 @@
+import os
+import re
+import time
+from array import array
+from datetime import timedelta
+from typing import Dict, List
+
+from django.utils import timezone
+
+from .caching import LRUCache
+from .models import ConversationSession
+
+
+class SessionStore:
+    """
+    Compact per-session chat state persisted in the Django DB, with an
+    optional in-process memory tier in front of it.
+
+    State is a dict: ``turns`` (recent, truncated), ``chunk_ids`` of the
+    last retrieval, the last ``query_embedding`` and the ``best_relevance``
+    of those chunks to it.
+    """
+
+    MAX_TURNS = 6
+    MAX_ANSWER_CHARS = 400
+
+    # Only strong signals count as a follow-up: an explicit client flag, a
+    # leading "what about"-style phrase, or a short question that leans on
+    # the previous turn ("and in pregnancy?", "is it safe?").
+    FOLLOW_UP_PREFIXES = ("what about", "how about", "and what about", "what if", "same for")
+    FOLLOW_UP_MAX_WORDS = 4
+    FOLLOW_UP_CONNECTIVES = {"and", "but", "also", "or"}
+    FOLLOW_UP_REFERENCES = {"it", "its", "that", "this", "they", "them", "those", "these"}
+
+    # Sessions not updated for this long are ignored and periodically
+    # deleted.
+    SESSION_TTL_S = float(os.getenv("CHAT_SESSION_TTL_S", "86400"))
+    PURGE_INTERVAL_S = 3600
+    _last_purge = None
+
+    # Write-through memory tier; only safe to enable with a single worker or
+    # sticky sessions, so it is off by default.
+    _memory = LRUCache(
+        max_entries=int(os.getenv("CHAT_SESSION_MEMORY_ENTRIES", "0")),
+        ttl_s=float(os.getenv("CHAT_SESSION_MEMORY_TTL_S", "1800")),
+    )
+
+
+    @staticmethod
+    def pack_embedding(embedding: List[float] | None) -> bytes | None:
+        if embedding is None:
+            return None
+        return array("f", embedding).tobytes()
+
+
+    @staticmethod
+    def unpack_embedding(data: bytes | None) -> List[float] | None:
+        if not data:
+            return None
+        values = array("f")
+        values.frombytes(bytes(data))
+        return values.tolist()
+
+
+    @classmethod
+    def compact_answer(cls, answer: str) -> str:
+        if len(answer) <= cls.MAX_ANSWER_CHARS:
+            return answer
+        cut = answer[:cls.MAX_ANSWER_CHARS]
+        return cut[:cut.rfind(" ")].rstrip() + " ..."
+
+
+    @classmethod
+    def load(cls, session_id: str) -> Dict | None:
+        state = cls._memory.get(session_id)
+        if state is not None:
+            return state
+
+        row = ConversationSession.objects.filter(
+            session_id=session_id, updated_at__gte=cls.expiry_cutoff()
+        ).first()
+        if row is None:
+            return None
+
+        state = {
+            "turns": row.turns,
+            "chunk_ids": row.chunk_ids,
+            "query_embedding": cls.unpack_embedding(row.query_embedding),
+            "best_relevance": row.best_relevance,
+        }
+        cls._memory.set(session_id, state)
+        return state
+
+
+    @classmethod
+    def record_turn(
+        cls,
+        session_id: str,
+        state: Dict | None,
+        query: str,
+        answer: str,
+        chunk_ids: List[str],
+        query_embedding: List[float] | None,
+        best_relevance: float | None = None
+    ) -> Dict:
+        turns = list(state["turns"]) if state else []
+        turns.append({"query": query, "answer": cls.compact_answer(answer)})
+        turns = turns[-cls.MAX_TURNS:]
+
+        new_state = {
+            "turns": turns,
+            "chunk_ids": chunk_ids,
+            "query_embedding": query_embedding,
+            "best_relevance": best_relevance,
+        }
+
+        ConversationSession.objects.update_or_create(
+            session_id=session_id,
+            defaults={
+                "turns": turns,
+                "chunk_ids": chunk_ids,
+                "query_embedding": cls.pack_embedding(query_embedding),
+                "best_relevance": best_relevance,
+            },
+        )
+        cls._memory.set(session_id, new_state)
+        cls._maybe_purge()
+        return new_state
+
+
+    @classmethod
+    def expiry_cutoff(cls):
+        return timezone.now() - timedelta(seconds=cls.SESSION_TTL_S)
+
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        deleted, _ = ConversationSession.objects.filter(
+            updated_at__lt=cls.expiry_cutoff()
+        ).delete()
+        return deleted
+
+
+    @classmethod
+    def _maybe_purge(cls):
+        # At most once per interval per process, piggybacking on writes.
+        now = time.monotonic()
+        if cls._last_purge is not None and now - cls._last_purge < cls.PURGE_INTERVAL_S:
+            return
+        cls._last_purge = now
+        cls.purge_expired()
+
+
+    @classmethod
+    def is_follow_up(
+        cls,
+        query: str,
+        state: Dict | None,
+        explicit: bool | None = None
+    ) -> bool:
+        if not state or not state["turns"]:
+            return False
+        if explicit is not None:
+            return explicit
+
+        q = query.lower().strip()
+        if q.startswith(cls.FOLLOW_UP_PREFIXES):
+            return True
+
+        words = re.findall(r"[a-z']+", q)
+        if not words or len(words) > cls.FOLLOW_UP_MAX_WORDS:
+            return False
+        return words[0] in cls.FOLLOW_UP_CONNECTIVES or any(
+            w in cls.FOLLOW_UP_REFERENCES for w in words
+        )
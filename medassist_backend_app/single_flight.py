@@ -0,0 +1,74 @@
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from .deadlines import DeadlineExceeded, check_deadline, remaining_time
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").split()).casefold().rstrip("?!. ")
+
+
+def freeze_filters(filters: Dict | None) -> str:
+    return json.dumps(filters or {}, sort_keys=True, default=str)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still in flight block and receive the same result (or exception).
+    Nothing is cached once the call completes. Shared results must be
+    treated as read-only by the callers. Waiters give up at their own
+    request deadline even if the leader is still running, and do not
+    inherit the leader's DeadlineExceeded: with time left, they run (or
+    join) a fresh call instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            remaining = remaining_time()
+            timeout = None if remaining is None else max(0.0, remaining)
+            if not call.done.wait(timeout=timeout):
+                raise DeadlineExceeded("Deadline exceeded waiting on shared call")
+            if isinstance(call.error, DeadlineExceeded):
+                check_deadline("shared call")
+                return self.do(key, fn, *args, **kwargs)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -1,3 +1,962 @@
-from django.test import TestCase
+import importlib
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .azure_clients import (
+    MAX_ATTEMPTS,
+    AdaptiveConcurrencyLimiter,
+    TokenBucket,
+    call_azure,
+    get_guard,
+    search_timeouts,
+)
+from .caching import LRUCache
+from .deadlines import DeadlineExceeded, check_deadline, deadline_scope, remaining_time
+from .diversity import CandidateDiversifier
+from .generation_cache import GenerationCache
+from .model_generation import FinalAnswerGenerator
+from .models import ConversationSession
+from .pipeline import ChatPipeline
+from .quantization import LocalVectorIndex, normalize
+from .query_classifier import QueryClassifier
+from .query_expansion import MedicalSynonymIndex, QueryExpander
+from .rerank_and_context import MedicalReranker
+from .retrieval import HybridRetriever
+from .session_store import SessionStore
+from .single_flight import SingleFlight, freeze_filters, normalize_query
+
+
+def run_in_threads(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+# ============================================================
+# Single-flight
+# ============================================================
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def wait_for_leader(self):
+        while not self.flight.in_flight():
+            time.sleep(0.001)
+        # Give the other callers time to join the in-flight call.
+        time.sleep(0.05)
+
+    def test_concurrent_callers_share_one_result(self):
+        threads, results, errors = run_in_threads(5, lambda: self.flight.do("k", self.slow, 42))
+        self.wait_for_leader()
+        self.release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual(self.flight.in_flight(), 0)
+
+    def test_concurrent_callers_share_one_exception(self):
+        error = RuntimeError("boom")
+        threads, _, errors = run_in_threads(3, lambda: self.flight.do("k", self.slow, error))
+        self.wait_for_leader()
+        self.release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(errors, [error] * 3)
+
+    def test_waiter_gives_up_at_its_own_deadline(self):
+        threads, results, _ = run_in_threads(1, lambda: self.flight.do("k", self.slow, 1))
+        self.wait_for_leader()
+
+        with deadline_scope(0.05):
+            with self.assertRaises(DeadlineExceeded):
+                self.flight.do("k", self.slow, 2)
+
+        self.release.set()
+        threads[0].join()
+        self.assertEqual(results, [1])
+        self.assertEqual(self.calls, 1)
+
+    def test_waiter_reruns_when_leader_hits_its_own_deadline(self):
+        def work():
+            self.calls += 1
+            time.sleep(0.1)
+            check_deadline()
+            return "done"
+
+        def leader():
+            with deadline_scope(0.05):
+                return self.flight.do("k", work)
+
+        threads, _, errors = run_in_threads(1, leader)
+        while not self.flight.in_flight():
+            time.sleep(0.001)
+
+        self.assertEqual(self.flight.do("k", work), "done")
+        threads[0].join()
+        self.assertIsInstance(errors[0], DeadlineExceeded)
+        self.assertEqual(self.calls, 2)
+
+    def test_nothing_is_cached_after_completion(self):
+        self.release.set()
+        self.flight.do("k", self.slow, 1)
+        self.assertEqual(self.flight.do("k", self.slow, 2), 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_key_helpers(self):
+        self.assertEqual(normalize_query("  What is  Diabetes?? "), "what is diabetes")
+        self.assertEqual(freeze_filters({"year": 2024, "source": "WHO"}), freeze_filters({"source": "WHO", "year": 2024}))
+
+
+class BudgetTierTests(SimpleTestCase):
+    def test_tight_budgets_do_not_share_a_run_with_default_budgets(self):
+        with deadline_scope(ChatPipeline.REQUEST_BUDGET_S):
+            default = ChatPipeline._budget_tier()
+        with deadline_scope(3):
+            tight = ChatPipeline._budget_tier()
+
+        self.assertEqual(default, (False, False, False, False))
+        self.assertEqual(tight, (True, True, True, True))
+        self.assertEqual(ChatPipeline._budget_tier(), default)
+
+
+class DegradedModeTests(SimpleTestCase):
+    DOCUMENTS = [
+        {"id": f"doc-{i}", "text": f"Evidence passage number {i}.", "embedding": [1.0, float(i)], "score": 1.0}
+        for i in range(4)
+    ]
+
+    def answer(self, budget_s):
+        retrieval = mock.Mock(return_value=(self.DOCUMENTS, [1.0, 0.0]))
+        rerank = mock.Mock(side_effect=lambda q, docs, top_k: docs[:top_k])
+        generate = mock.Mock(return_value="ok")
+        # No rule-based intent matches, so the classifier would call the LLM.
+        with mock.patch.object(QueryClassifier, "classify_query_llm", return_value="general_education") as classify, \
+                mock.patch.object(HybridRetriever, "hybrid_retrieval", retrieval), \
+                mock.patch.object(MedicalReranker, "medical_rerank", rerank), \
+                mock.patch.object(FinalAnswerGenerator, "generate_final_answer", generate):
+            result = ChatPipeline.answer(f"how long does recovery {budget_s} take", budget_s=budget_s)
+
+        return SimpleNamespace(
+            degradations=result["degradations"],
+            classifier_called=classify.called,
+            top_k=retrieval.call_args.kwargs["top_k"],
+            rerank_called=rerank.called,
+            max_tokens=generate.call_args.kwargs["max_tokens"],
+        )
+
+    def test_full_budget_runs_every_stage(self):
+        run = self.answer(20)
+        self.assertEqual(run.degradations, [])
+        self.assertTrue(run.classifier_called)
+        self.assertEqual(run.top_k, ChatPipeline.RETRIEVAL_TOP_K)
+        self.assertTrue(run.rerank_called)
+        self.assertEqual(run.max_tokens, ChatPipeline.MAX_TOKENS)
+
+    def test_below_classifier_threshold_skips_llm_classifier(self):
+        run = self.answer(13)
+        self.assertEqual(run.degradations, ["classifier_llm_skipped"])
+        self.assertFalse(run.classifier_called)
+        self.assertEqual(run.top_k, ChatPipeline.RETRIEVAL_TOP_K)
+        self.assertTrue(run.rerank_called)
+
+    def test_below_top_k_threshold_shrinks_retrieval(self):
+        run = self.answer(11)
+        self.assertEqual(run.degradations, ["classifier_llm_skipped", "top_k_reduced"])
+        self.assertEqual(run.top_k, ChatPipeline.DEGRADED_TOP_K)
+        self.assertTrue(run.rerank_called)
+        self.assertEqual(run.max_tokens, ChatPipeline.MAX_TOKENS)
+
+    def test_below_rerank_threshold_skips_reranker(self):
+        run = self.answer(8)
+        self.assertEqual(
+            run.degradations, ["classifier_llm_skipped", "top_k_reduced", "rerank_skipped"]
+        )
+        self.assertFalse(run.rerank_called)
+        self.assertEqual(run.max_tokens, ChatPipeline.MAX_TOKENS)
+
+    def test_below_max_tokens_threshold_shrinks_answer(self):
+        run = self.answer(3)
+        self.assertEqual(
+            run.degradations,
+            ["classifier_llm_skipped", "top_k_reduced", "rerank_skipped", "max_tokens_reduced"],
+        )
+        self.assertFalse(run.classifier_called)
+        self.assertEqual(run.top_k, ChatPipeline.DEGRADED_TOP_K)
+        self.assertFalse(run.rerank_called)
+        self.assertEqual(run.max_tokens, ChatPipeline.DEGRADED_MAX_TOKENS)
+
+
+# ============================================================
+# Filters
+# ============================================================
+class FilterTests(SimpleTestCase):
+    def test_build_filter_escapes_values(self):
+        self.assertEqual(
+            HybridRetriever.build_filter({"source": "O'Brien", "year": 2024}),
+            "source eq 'O''Brien' and year eq 2024",
+        )
+        self.assertIsNone(HybridRetriever.build_filter(None))
+
+    def test_unknown_fields_are_rejected(self):
+        with self.assertRaises(ValueError):
+            HybridRetriever.build_filter({"source eq 'x' or id": "y"})
+
+    def test_wrong_value_types_are_rejected(self):
+        for filters in ({"year": "2024"}, {"year": True}, {"source": ["a", "b"]}, {"source": {"x": 1}}, ["year"]):
+            with self.assertRaises(ValueError, msg=filters):
+                HybridRetriever.validate_filters(filters)
+
+    def test_views_return_400_for_invalid_filters(self):
+        client = APIClient()
+        bad = {"source eq 'x' or id": "y"}
+
+        response = client.post("/chat/", {"query": "q", "filters": bad}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post("/chat/batch/", {"queries": ["q"], "filters": {"year": [1]}}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+# ============================================================
+# Azure call guard
+# ============================================================
+class FakeAzureError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_empty(self):
+        bucket = TokenBucket(rate=1.0, capacity=2.0)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0))
+
+    def test_pause_blocks_until_retry_after(self):
+        bucket = TokenBucket(rate=1000.0, capacity=10.0)
+        bucket.pause(0.05)
+        self.assertFalse(bucket.acquire(timeout=0.01))
+        self.assertTrue(bucket.acquire(timeout=1))
+
+
+class AdaptiveConcurrencyLimiterTests(SimpleTestCase):
+    def test_limit_is_enforced(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=2, maximum=4)
+        self.assertTrue(limiter.acquire(timeout=0))
+        self.assertTrue(limiter.acquire(timeout=0))
+        self.assertFalse(limiter.acquire(timeout=0))
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=4, maximum=8)
+        limiter.acquire()
+        limiter.release()
+        self.assertAlmostEqual(limiter.limit, 4.25)
+
+        limiter.acquire()
+        limiter.acquire()
+        limiter.release(throttled=True)
+        limiter.release(throttled=True)
+        # A burst of 429s within the cooldown halves the limit once.
+        self.assertAlmostEqual(limiter.limit, 4.25 / 2)
+
+
+class CallAzureTests(SimpleTestCase):
+    def name(self):
+        # Guards are per (kind, name) and process-wide; keep tests apart.
+        return f"test-{self._testMethodName}"
+
+    def test_retries_throttled_call_after_retry_after(self):
+        attempts = []
+
+        def fn(timeout):
+            attempts.append(timeout)
+            if len(attempts) < 3:
+                raise FakeAzureError(429, {"retry-after-ms": "10"})
+            return "ok"
+
+        self.assertEqual(call_azure("search", self.name(), fn), "ok")
+        self.assertEqual(len(attempts), 3)
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        attempts = []
+
+        def fn(timeout):
+            attempts.append(timeout)
+            raise FakeAzureError(400)
+
+        with self.assertRaises(FakeAzureError):
+            call_azure("search", self.name(), fn)
+        self.assertEqual(len(attempts), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        attempts = []
+
+        def fn(timeout):
+            attempts.append(timeout)
+            raise FakeAzureError(503, {"retry-after-ms": "1"})
+
+        with self.assertRaises(FakeAzureError):
+            call_azure("search", self.name(), fn)
+        self.assertEqual(len(attempts), MAX_ATTEMPTS)
+
+    def test_attempt_timeout_is_clipped_to_deadline(self):
+        timeouts = []
+        with deadline_scope(0.5):
+            call_azure("search", self.name(), lambda timeout: timeouts.append(timeout))
+        self.assertLessEqual(timeouts[0], 0.5)
+
+    def test_running_out_of_deadline_raises_deadline_exceeded(self):
+        error = FakeAzureError(503, {"retry-after": "5"})
+
+        def fn(timeout):
+            raise error
+
+        with deadline_scope(0.5):
+            with self.assertRaises(DeadlineExceeded) as raised:
+                call_azure("search", self.name(), fn)
+        self.assertIs(raised.exception.__cause__, error)
+
+    def test_search_read_timeout_is_bounded(self):
+        self.assertEqual(
+            search_timeouts(3.0),
+            {"timeout": 3.0, "connection_timeout": 3.0, "read_timeout": 3.0},
+        )
+        self.assertEqual(search_timeouts(10.0)["connection_timeout"], 5.0)
+
+    def test_hedged_call_is_bounded_by_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        started = time.monotonic()
+        with deadline_scope(0.2):
+            with self.assertRaises(DeadlineExceeded):
+                call_azure("search", self.name(), lambda timeout: release.wait(5), hedge=True)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_slow_primary_is_hedged(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        get_guard("search", self.name()).timeout = 0.4  # cold hedge delay: 0.1s
+        calls = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(5)
+                return "primary"
+            return "backup"
+
+        self.assertEqual(call_azure("search", self.name(), fn, hedge=True), "backup")
+        self.assertEqual(len(calls), 2)
+
+    def test_expired_deadline_fails_before_calling(self):
+        with deadline_scope(0):
+            with self.assertRaises(DeadlineExceeded):
+                call_azure("search", self.name(), lambda timeout: self.fail("called"))
+
+
+# ============================================================
+# Hybrid retrieval and batches
+# ============================================================
+class HybridRetrievalTests(SimpleTestCase):
+    def test_keyword_and_vector_search_overlap(self):
+        retrieval = HybridRetriever()
+        seen_deadlines = []
+
+        def vector_search(embedding, k, filters, candidate_ids):
+            time.sleep(0.2)
+            return {"a": {"text": "A", "embedding": [1.0], "vector_score": 0.9}}
+
+        def keyword_search(query, k, filters, candidate_ids, seed_terms):
+            seen_deadlines.append(remaining_time())
+            time.sleep(0.2)
+            return {"b": {"text": "B", "bm25_score": 3.0}}
+
+        started = time.monotonic()
+        with mock.patch.object(retrieval, "vector_search", vector_search), \
+                mock.patch.object(retrieval, "keyword_search", keyword_search), \
+                deadline_scope(5):
+            merged, _ = retrieval.hybrid_retrieval("q", top_k=5, query_embedding=[1.0])
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual([d["id"] for d in merged], ["a", "b"])
+        # The request deadline reaches the pool thread.
+        self.assertIsNotNone(seen_deadlines[0])
+
+    def test_keyword_search_overlaps_embedding(self):
+        retrieval = HybridRetriever()
+
+        def embed_query(query):
+            time.sleep(0.2)
+            return [1.0]
+
+        def keyword_search(query, k, filters, candidate_ids, seed_terms):
+            time.sleep(0.2)
+            return {"b": {"text": "B", "bm25_score": 3.0}}
+
+        started = time.monotonic()
+        with mock.patch.object(retrieval, "embed_query", embed_query), \
+                mock.patch.object(retrieval, "vector_search", return_value={}), \
+                mock.patch.object(retrieval, "keyword_search", keyword_search):
+            merged, embedding = retrieval.hybrid_retrieval("q", top_k=5)
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual([d["id"] for d in merged], ["b"])
+        self.assertEqual(embedding, [1.0])
+
+    def test_simhash_is_selected_only_when_the_index_has_it(self):
+        selects = {}
+        for enabled in (False, True):
+            retrieval = HybridRetriever()
+            retrieval.SIMHASH_FIELD = enabled
+            client = mock.Mock()
+            client.search.return_value = [{"id": "a", "content": "A", "@search.score": 1.0}]
+            with mock.patch.object(HybridRetriever, "search_client", new_callable=mock.PropertyMock, return_value=client):
+                hits = retrieval._keyword_search("asthma", "simple", 5, None)
+            selects[enabled] = client.search.call_args.kwargs["select"]
+            self.assertIsNone(hits["a"]["simhash"])
+
+        self.assertNotIn("simhash", selects[False])
+        self.assertIn("simhash", selects[True])
+
+
+class BatchTests(SimpleTestCase):
+    def test_batch_budget_applies_to_every_query(self):
+        def answer(query, filters, embedding):
+            if query == "slow":
+                time.sleep(0.3)
+                check_deadline()
+            return {"answer": query, "degradations": []}, {}
+
+        with mock.patch.object(HybridRetriever, "embed_queries", lambda self, qs: [None] * len(qs)), \
+                mock.patch.object(ChatPipeline, "_classify_and_answer", side_effect=answer):
+            results = list(ChatPipeline.answer_batch(["fast", "slow"], budget_s=0.1))
+
+        by_query = {r["query"]: r for r in results}
+        self.assertEqual(by_query["fast"]["answer"], "fast")
+        self.assertIn("Deadline exceeded", by_query["slow"]["error"])
+
+    def test_http_batch_size_is_capped(self):
+        queries = ["q"] * (ChatPipeline.BATCH_HTTP_MAX_QUERIES + 1)
+        response = APIClient().post("/chat/batch/", {"queries": queries}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("chat_batch", response.json()["error"])
+
+
+# ============================================================
+# Sessions
+# ============================================================
+class FollowUpDetectionTests(SimpleTestCase):
+    state = {"turns": [{"query": "What is asthma?", "answer": "..."}]}
+
+    def test_new_questions_are_not_follow_ups(self):
+        for query in (
+            "What is hypertension and how is it treated?",
+            "Is it safe to exercise with asthma?",
+            "For adults, how much sleep is recommended?",
+            "diabetes symptoms",
+        ):
+            self.assertFalse(SessionStore.is_follow_up(query, self.state), query)
+
+    def test_follow_up_signals(self):
+        for query in ("What about for children?", "and in pregnancy?", "Is it safe?", "how about them"):
+            self.assertTrue(SessionStore.is_follow_up(query, self.state), query)
+
+    def test_explicit_flag_wins_but_needs_a_session(self):
+        self.assertFalse(SessionStore.is_follow_up("what about kids?", self.state, explicit=False))
+        self.assertTrue(SessionStore.is_follow_up("Tell me about insulin", self.state, explicit=True))
+        self.assertFalse(SessionStore.is_follow_up("what about kids?", None, explicit=True))
+
+
+class SessionStoreTests(TestCase):
+    def test_expired_sessions_are_ignored_and_purged(self):
+        SessionStore.record_turn("s1", None, "q", "a", ["c1"], [0.5, 0.25], 0.75)
+        self.assertEqual(SessionStore.load("s1")["query_embedding"], [0.5, 0.25])
+        self.assertEqual(SessionStore.load("s1")["best_relevance"], 0.75)
+
+        ConversationSession.objects.filter(session_id="s1").update(
+            updated_at=timezone.now() - timedelta(seconds=SessionStore.SESSION_TTL_S + 60)
+        )
+        self.assertIsNone(SessionStore.load("s1"))
+        self.assertEqual(SessionStore.purge_expired(), 1)
+        self.assertFalse(ConversationSession.objects.exists())
+
+
+class ChatViewSessionTests(TestCase):
+    def post(self, body):
+        result = (
+            {"answer": "ok", "degradations": []},
+            {"chunk_ids": ["c1"], "query_embedding": None, "best_relevance": 0.0},
+        )
+        with mock.patch.object(ChatPipeline, "_classify_and_answer", return_value=result):
+            return APIClient().post("/chat/", body, format="json")
+
+    def test_stateless_requests_store_nothing(self):
+        response = self.post({"query": "What is asthma?"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("session_id", response.json())
+        self.assertFalse(ConversationSession.objects.exists())
+
+    def test_client_session_is_recorded(self):
+        response = self.post({"query": "What is asthma?", "session_id": "abc"})
+        self.assertEqual(response.json()["session_id"], "abc")
+        row = ConversationSession.objects.get()
+        self.assertEqual(row.chunk_ids, ["c1"])
+        self.assertEqual(row.best_relevance, 0.0)
+
+    def test_invalid_session_fields_are_rejected(self):
+        self.assertEqual(self.post({"query": "q", "session_id": "x" * 65}).status_code, 400)
+        self.assertEqual(self.post({"query": "q", "session_id": 5}).status_code, 400)
+        self.assertEqual(self.post({"query": "q", "follow_up": "yes"}).status_code, 400)
+
+
+class FollowUpRetrievalTests(SimpleTestCase):
+    def answer_with(self, previous_embedding, previous_relevance=None):
+        fresh = [{"id": "fresh", "text": "Adults should sleep 7 hours.", "embedding": [1.0, 0.0], "score": 1.0}]
+        previous = [{"id": "old", "text": "Asthma patients should avoid smoke.", "embedding": previous_embedding, "score": 1.0}]
+        searches = []
+
+        def hybrid_retrieval(query, candidate_ids=None, **kwargs):
+            searches.append("limited" if candidate_ids else "fresh")
+            return (previous if candidate_ids else fresh), kwargs["query_embedding"]
+
+        conversation = {
+            "history": [],
+            "candidate_ids": ["old"],
+            "retrieval_query": "q",
+            "query_embedding": [1.0, 0.0],
+            "previous_relevance": previous_relevance,
+        }
+        with mock.patch.object(HybridRetriever, "hybrid_retrieval", side_effect=hybrid_retrieval), \
+                mock.patch.object(MedicalReranker, "medical_rerank", side_effect=lambda q, docs, top_k: docs[:top_k]), \
+                mock.patch.object(FinalAnswerGenerator, "generate_final_answer", return_value="ok"):
+            _, context = ChatPipeline._answer("q", "general_education", None, conversation=conversation)
+        return context["chunk_ids"], searches
+
+    def test_previous_chunks_kept_while_still_relevant(self):
+        chunk_ids, searches = self.answer_with([0.95, 0.31], previous_relevance=1.0)
+        self.assertEqual(chunk_ids, ["old"])
+        # No fresh search when the previous chunks still match.
+        self.assertEqual(searches, ["limited"])
+
+    def test_topic_change_falls_back_to_fresh_search(self):
+        chunk_ids, searches = self.answer_with([0.0, 1.0])
+        self.assertEqual(chunk_ids, ["fresh"])
+        self.assertEqual(searches, ["limited", "fresh"])
+
+    def test_drop_from_previous_relevance_falls_back_to_fresh_search(self):
+        # 0.8 clears the absolute floor but not 0.9 x last turn's 0.95.
+        chunk_ids, searches = self.answer_with([0.8, 0.6], previous_relevance=0.95)
+        self.assertEqual(chunk_ids, ["fresh"])
+        self.assertEqual(searches, ["limited", "fresh"])
+
+
+# ============================================================
+# Local vector index
+# ============================================================
+SAMPLE_VECTORS = {
+    "a": normalize([1.0, 0.1, 0.0, 0.0]),
+    "b": normalize([0.0, 1.0, 0.1, 0.0]),
+    "c": normalize([0.0, 0.0, 1.0, 0.1]),
+    "d": normalize([0.7, 0.7, 0.0, 0.0]),
+}
+
+
+def build_index(mode, ids=None):
+    index = LocalVectorIndex(4, mode)
+    for doc_id in ids or SAMPLE_VECTORS:
+        index.add(doc_id, SAMPLE_VECTORS[doc_id])
+    return index
+
+
+class LocalVectorIndexTests(SimpleTestCase):
+    def test_search_ranks_by_exact_rescore(self):
+        for mode in ("binary", "int8"):
+            hits = build_index(mode).search(normalize([1.0, 0.2, 0.0, 0.0]), k=2, rescore_candidates=4)
+            self.assertEqual([h["id"] for h in hits], ["a", "d"], mode)
+
+    def test_save_and_load_round_trip(self):
+        for mode in ("binary", "int8"):
+            with tempfile.TemporaryDirectory() as path:
+                build_index(mode).save(path)
+                loaded = LocalVectorIndex.load(path)
+
+                self.assertEqual((loaded.mode, len(loaded)), (mode, 4))
+                for (doc_id, vector), expected in zip(loaded.items(), SAMPLE_VECTORS.items()):
+                    self.assertEqual(doc_id, expected[0])
+                    for x, y in zip(vector, expected[1]):
+                        self.assertAlmostEqual(x, y, places=6)
+                with self.assertRaises(RuntimeError):
+                    loaded.add("e", SAMPLE_VECTORS["a"])
+
+    def test_dimension_mismatch_is_rejected(self):
+        with self.assertRaises(ValueError):
+            LocalVectorIndex(3).add("x", SAMPLE_VECTORS["a"])
+
+    def test_resave_never_mixes_versions(self):
+        with tempfile.TemporaryDirectory() as path:
+            build_index("binary", ["a", "b"]).save(path)
+            first = LocalVectorIndex.load(path)
+
+            build_index("binary", ["a", "b", "c"]).save(path)
+            second = LocalVectorIndex.load(path)
+            self.assertEqual(len(second), 3)
+            self.assertEqual(len(second._binary_codes), 3)
+            # The index loaded before the re-save still reads its own files.
+            self.assertEqual([doc_id for doc_id, _ in first.items()], ["a", "b"])
+
+            build_index("binary", ["d"]).save(path)
+            versions = [name for name in os.listdir(path) if name.startswith("data-")]
+            self.assertEqual(len(versions), 2)
+            self.assertEqual(LocalVectorIndex.load(path).ids, ["d"])
+
+
+class LocalIndexReloadTests(SimpleTestCase):
+    def test_missing_index_falls_back_to_azure(self):
+        retrieval = HybridRetriever()
+        with tempfile.TemporaryDirectory() as path:
+            retrieval.LOCAL_VECTOR_INDEX = os.path.join(path, "not-built-yet")
+            self.assertIsNone(retrieval.local_index())
+
+    def test_reingest_is_picked_up(self):
+        retrieval = HybridRetriever()
+
+        with tempfile.TemporaryDirectory() as path:
+            retrieval.LOCAL_VECTOR_INDEX = path
+            build_index("binary", ["a", "b"]).save(path)
+            first = retrieval.local_index()
+            self.assertEqual(len(first), 2)
+            self.assertIs(retrieval.local_index(), first)
+
+            # Filesystem timestamps can be coarse; make sure the rewrite is newer.
+            time.sleep(0.05)
+            build_index("binary", ["a", "b", "c"]).save(path)
+            self.assertEqual(len(retrieval.local_index()), 3)
+
+
+# ============================================================
+# Candidate diversity
+# ============================================================
+class CandidateDiversifierTests(SimpleTestCase):
+    text = (
+        "Adults with type 2 diabetes should limit refined carbohydrates, "
+        "prefer whole grains and vegetables, and keep regular meal times."
+    )
+
+    def test_simhash_is_stable_and_stored_as_hex(self):
+        signature = CandidateDiversifier.simhash(self.text)
+        self.assertEqual(signature, CandidateDiversifier.simhash(self.text.upper()))
+        self.assertEqual(
+            CandidateDiversifier.signature({"simhash": CandidateDiversifier.simhash_hex(self.text)}),
+            signature,
+        )
+        self.assertLess(signature, 1 << 64)
+
+    def test_near_duplicates_keep_the_best_scored_copy(self):
+        chunks = [
+            {"id": "best", "text": self.text, "score": 0.9},
+            {"id": "copy", "text": self.text + " ", "score": 0.8},
+            {"id": "near", "simhash": f"{CandidateDiversifier.simhash(self.text) ^ 0b101:016x}", "score": 0.7},
+            {"id": "other", "text": "Children need nine to twelve hours of sleep per night.", "score": 0.5},
+        ]
+        selected = CandidateDiversifier.diversify(chunks, k=10)
+        self.assertEqual([c["id"] for c in selected], ["best", "other"])
+        self.assertNotIn("_signature", selected[0])
+
+    def test_mmr_prefers_novel_chunks_over_redundant_ones(self):
+        chunks = [
+            {"id": "a", "text": "sleep hygiene for adults", "embedding": [1.0, 0.0], "score": 1.0},
+            {"id": "a2", "text": "bedtime routines for grown ups", "embedding": [0.99, 0.14], "score": 0.95},
+            {"id": "b", "text": "salt intake and blood pressure", "embedding": [0.0, 1.0], "score": 0.8},
+        ]
+        selected = CandidateDiversifier.diversify(chunks, k=2)
+        self.assertEqual([c["id"] for c in selected], ["a", "b"])
+
+
+# ============================================================
+# Ingestion
+# ============================================================
+class IngestTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # ingest.py is a script that builds its (offline) clients at import.
+        with mock.patch.dict(os.environ, {
+            "AZURE_SEARCH_ENDPOINT": "https://search.invalid",
+            "AZURE_SEARCH_KEY": "key",
+            "AZURE_SEARCH_INDEX": "index",
+            "AZURE_OPENAI_EMBEDDING_ENDPOINT": "https://openai.invalid",
+            "AZURE_OPENAI_EMBEDDING_KEY": "key",
+            "AZURE_OPENAI_API_VERSION": "2024-06-01",
+        }):
+            cls.ingest = importlib.import_module("ingest")
+
+    def test_chunk_pages_matches_chunk_text(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            pages = [
+                "".join(rng.choice("ab \n") for _ in range(rng.randint(0, 400)))
+                for _ in range(rng.randint(0, 8))
+            ]
+            chunk_size = rng.randint(20, 200)
+            overlap = rng.randint(0, chunk_size - 1)
+
+            self.assertEqual(
+                list(self.ingest.chunk_pages(iter(pages), chunk_size, overlap)),
+                self.ingest.chunk_text("\n".join(pages), chunk_size, overlap),
+                (pages, chunk_size, overlap),
+            )
+
+    def test_text_cache_marks_files_complete_only_after_every_page(self):
+        cache = self.ingest.PdfTextCache(":memory:")
+        pages = ["page one", "page two", "page three"]
+
+        partial = cache.store_pages("h", iter(pages))
+        next(partial)
+        partial.close()
+        self.assertFalse(cache.is_complete("h"))
+
+        self.assertEqual(list(cache.store_pages("h", iter(pages))), pages)
+        self.assertTrue(cache.is_complete("h"))
+        self.assertEqual(list(cache.iter_pages("h")), pages)
+
+
+# ============================================================
+# Query expansion
+# ============================================================
+class QueryExpansionTests(SimpleTestCase):
+    def test_lay_terms_expand_to_weighted_synonyms(self):
+        self.assertEqual(
+            QueryExpander.expand("Is high blood sugar dangerous?"),
+            '(Is high blood sugar dangerous\\?) OR "hyperglycemia"^0.8',
+        )
+
+    def test_longest_phrase_wins(self):
+        self.assertEqual(
+            MedicalSynonymIndex.get().find_terms("high blood pressure and blood sugar"),
+            ["high blood pressure", "blood sugar"],
+        )
+
+    def test_no_expansion_returns_none(self):
+        self.assertIsNone(QueryExpander.expand("how much sleep do adults need"))
+        # Nothing to add when the user already used the synonym.
+        self.assertIsNone(QueryExpander.expand("hypertension high blood pressure"))
+
+    def test_seed_terms_are_expanded(self):
+        self.assertIn('"myocardial infarction"', QueryExpander.expand("chest pain", ["heart attack"]))
+
+    def test_user_text_cannot_inject_lucene_syntax(self):
+        expanded = QueryExpander.expand('AND OR NOT high blood pressure "quoted" (x)')
+        self.assertTrue(expanded.startswith(
+            '(and or not high blood pressure \\"quoted\\" \\(x\\)) OR "hypertension"^0.8'
+        ))
+
+    def test_keyword_search_falls_back_to_simple_syntax_on_400(self):
+        retrieval = HybridRetriever()
+        calls = []
+
+        def keyword_search(search_text, query_type, k, odata_filter):
+            calls.append((search_text, query_type))
+            if query_type == "full":
+                raise FakeAzureError(400)
+            return {}
+
+        with mock.patch.object(retrieval, "_keyword_search", keyword_search):
+            self.assertEqual(retrieval.keyword_search(" high blood pressure "), {})
+
+        self.assertEqual(calls[0][1], "full")
+        self.assertEqual(calls[1], ("high blood pressure", "simple"))
+
+    def test_other_errors_are_not_swallowed(self):
+        retrieval = HybridRetriever()
+        with mock.patch.object(retrieval, "_keyword_search", side_effect=FakeAzureError(503)):
+            with self.assertRaises(FakeAzureError):
+                retrieval.keyword_search("high blood pressure")
+
+
+# ============================================================
+# Generation cache
+# ============================================================
+class GenerationCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.version_file = os.path.join(self.tmp.name, "index_version")
+        self.version_writes = 0
+        self.write_version("v1")
+        self.use_cache()
+
+    def use_cache(self, sqlite=False, ttl_s=60.0):
+        # Fresh class state per test (and per simulated worker process).
+        for patcher in (
+            mock.patch.multiple(
+                GenerationCache,
+                TTL_S=ttl_s,
+                SQLITE_PATH=os.path.join(self.tmp.name, "cache.sqlite3") if sqlite else None,
+                INDEX_VERSION_FILE=self.version_file,
+                _memory=LRUCache(max_entries=10, ttl_s=ttl_s),
+                _connection=None,
+                _stats={"memory_hits": 0, "shared_hits": 0, "misses": 0, "tokens_saved": 0},
+                _version=(None, None),
+                _pruned_version=None,
+            ),
+            mock.patch.dict(os.environ, {"INDEX_VERSION": ""}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        if sqlite:
+            self.addCleanup(lambda: GenerationCache._connection and GenerationCache._connection.close())
+
+    def write_version(self, version):
+        with open(self.version_file, "w", encoding="utf-8") as f:
+            f.write(version)
+        # Filesystem timestamps can be coarse; give each write its own mtime.
+        self.version_writes += 1
+        os.utime(self.version_file, (self.version_writes, self.version_writes))
+
+    def test_key_covers_model_parameters_and_index_version(self):
+        key, version = GenerationCache.make_key({"q": 1}, "gpt", 0.2, 450)
+        self.assertEqual(version, "v1")
+        self.assertEqual(key, GenerationCache.make_key({"q": 1}, "gpt", 0.2, 450)[0])
+
+        for args in (({"q": 2}, "gpt", 0.2, 450), ({"q": 1}, "gpt-mini", 0.2, 450),
+                     ({"q": 1}, "gpt", 0.7, 450), ({"q": 1}, "gpt", 0.2, 200)):
+            self.assertNotEqual(key, GenerationCache.make_key(*args)[0], args)
+
+        self.write_version("v2")
+        self.assertNotEqual(key, GenerationCache.make_key({"q": 1}, "gpt", 0.2, 450)[0])
+
+    def test_hits_and_tokens_saved_are_counted(self):
+        key, version = GenerationCache.make_key("p", "gpt", 0.2, 450)
+        self.assertIsNone(GenerationCache.get(key))
+        GenerationCache.set(key, version, "answer", 120)
+        self.assertEqual(GenerationCache.get(key), "answer")
+
+        stats = GenerationCache.stats()
+        self.assertEqual((stats["memory_hits"], stats["misses"], stats["tokens_saved"]), (1, 1, 120))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_entries_expire(self):
+        self.use_cache(sqlite=True, ttl_s=0.05)
+        key, version = GenerationCache.make_key("p", "gpt", 0.2, 450)
+        GenerationCache.set(key, version, "answer", 10)
+        time.sleep(0.1)
+        self.assertIsNone(GenerationCache.get(key))
+
+    def test_shared_backend_is_used_by_other_workers_and_pruned_on_reingest(self):
+        self.use_cache(sqlite=True)
+        key, version = GenerationCache.make_key("p", "gpt", 0.2, 450)
+        GenerationCache.set(key, version, "answer", 10)
+
+        self.use_cache(sqlite=True)
+        self.assertEqual(GenerationCache.get(key), "answer")
+        self.assertEqual(GenerationCache.stats()["shared_hits"], 1)
+
+        self.write_version("v2")
+        new_key, new_version = GenerationCache.make_key("p", "gpt", 0.2, 450)
+        self.assertIsNone(GenerationCache.get(new_key))
+        GenerationCache.set(new_key, new_version, "fresh answer", 10)
+
+        rows = GenerationCache._shared().execute("SELECT index_version FROM generations").fetchall()
+        self.assertEqual(rows, [("v2",)])
+
+    def test_generator_reuses_answers_for_the_same_cache_messages(self):
+        calls = []
+
+        def create(**kwargs):
+            calls.append(kwargs)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=" Sleep 7-9 hours. "))],
+                usage=SimpleNamespace(total_tokens=321),
+            )
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        messages = [{"role": "user", "content": normalize_query("How much sleep?")}]
+
+        with mock.patch.object(FinalAnswerGenerator, "get_chat_client", return_value=client):
+            first = FinalAnswerGenerator.generate_final_answer([{"role": "user", "content": "How much sleep?"}], cache_key_messages=messages)
+            again = FinalAnswerGenerator.generate_final_answer([{"role": "user", "content": "how much sleep"}], cache_key_messages=messages)
+            shorter = FinalAnswerGenerator.generate_final_answer([], max_tokens=200, cache_key_messages=messages)
+
+        self.assertEqual((first, again, shorter), ("Sleep 7-9 hours.",) * 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(GenerationCache.stats()["tokens_saved"], 321)
+
+    def test_pipeline_keys_on_the_prompt_built_from_the_normalized_question(self):
+        documents = [{"id": "a", "text": "Adults need 7-9 hours of sleep.", "embedding": [1.0, 0.0], "score": 1.0}]
+        create = mock.Mock(return_value=SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="Sleep 7-9 hours."))],
+            usage=SimpleNamespace(total_tokens=100),
+        ))
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+        def answer(query, history=None):
+            conversation = None
+            if history is not None:
+                conversation = {
+                    "history": history,
+                    "candidate_ids": [],
+                    "retrieval_query": query,
+                    "query_embedding": [1.0, 0.0],
+                    "previous_relevance": None,
+                }
+            return ChatPipeline._answer(query, "general_education", None, conversation=conversation)
+
+        with mock.patch.object(HybridRetriever, "hybrid_retrieval", return_value=(documents, [1.0, 0.0])), \
+                mock.patch.object(MedicalReranker, "medical_rerank", side_effect=lambda q, docs, top_k: docs[:top_k]), \
+                mock.patch.object(FinalAnswerGenerator, "get_chat_client", return_value=client):
+            answer("How much sleep?")
+            answer("  how much SLEEP ")
+            self.assertEqual(create.call_count, 1)
+
+            answer("How much sleep?", history=[{"query": "Is coffee bad?", "answer": "In moderation it is fine."}])
+            answer("How much exercise?")
+            self.assertEqual(create.call_count, 3)
+
+    def test_safety_gate_runs_on_cached_answers(self):
+        key, version = GenerationCache.make_key(
+            [{"role": "user", "content": "q"}], FinalAnswerGenerator.AZURE_OPENAI_CHAT_DEPLOYMENT, 0.2, 450
+        )
+        GenerationCache.set(key, version, "Take 500 mg twice daily.", 10)
+
+        with mock.patch.object(FinalAnswerGenerator, "get_chat_client"):
+            answer = FinalAnswerGenerator.generate_final_answer([{"role": "user", "content": "q"}])
+        self.assertIn("restricted medical content", answer)
@@ -1,30 +1,111 @@
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .query_classifier import QueryClassifier
-from .retrieval import HybridRetriever
-from .evidence_conditioning import EvidenceConditioner
-from .rerank_and_context import MedicalReranker
-from .prompt_assembly import PromptAssembler
-from .model_generation import FinalAnswerGenerator
+from .deadlines import DeadlineExceeded
+from .generation_cache import GenerationCache
+
+# The pipeline (and with it the OpenAI / Azure SDKs) is imported inside the
+# handlers so loading the URLconf stays cheap; see ChatPipeline.warm_up().
 
 class ChatView(APIView):
     def post(self, request):
         query = request.data.get("query")
-        
-        classifier = QueryClassifier()
-        flag = classifier.classify_query(query)
+        filters = request.data.get("filters")
+        # Sessions are opt-in: without a session_id nothing is stored.
+        session_id = request.data.get("session_id")
+        follow_up = request.data.get("follow_up")
+
+        if session_id is not None and (
+            not isinstance(session_id, str) or not 0 < len(session_id) <= 64
+        ):
+            return Response(
+                {"error": "'session_id' must be a string of 1 to 64 characters."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if follow_up is not None and not isinstance(follow_up, bool):
+            return Response(
+                {"error": "'follow_up' must be a boolean."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from .pipeline import ChatPipeline
+        from .retrieval import HybridRetriever
+
+        try:
+            HybridRetriever.validate_filters(filters)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Callers (e.g. the frontend or a proxy) may propagate a tighter
+        # deadline in seconds.
+        try:
+            budget_s = float(request.headers.get("X-Request-Timeout"))
+        except (TypeError, ValueError):
+            budget_s = None
+
+        try:
+            result = ChatPipeline.answer(
+                query,
+                filters=filters,
+                budget_s=budget_s,
+                session_id=session_id,
+                follow_up=follow_up,
+            )
+        except DeadlineExceeded:
+            return Response(
+                {"answer": "The request timed out. Please try again."},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
+
+        return Response(result)
+
+
+class BatchChatView(APIView):
+    def post(self, request):
+        from .pipeline import ChatPipeline
+        from .retrieval import HybridRetriever
+
+        queries = request.data.get("queries")
+        filters = request.data.get("filters")
+
+        try:
+            HybridRetriever.validate_filters(filters)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        retrieval = HybridRetriever()
-        documents = retrieval.hybrid_retrieval(query, top_k=10)
+        if (
+            not isinstance(queries, list)
+            or not queries
+            or not all(isinstance(q, str) and q.strip() for q in queries)
+        ):
+            return Response(
+                {"error": "'queries' must be a non-empty list of strings."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        evidence_docs = EvidenceConditioner.prepare_llm_context(documents)
+        if len(queries) > ChatPipeline.BATCH_HTTP_MAX_QUERIES:
+            return Response(
+                {"error": (
+                    f"At most {ChatPipeline.BATCH_HTTP_MAX_QUERIES} queries per request; "
+                    "use 'manage.py chat_batch' for bulk runs."
+                )},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        rerank = MedicalReranker()
-        reranked_chunks = rerank.medical_rerank(query, evidence_docs, top_k=3)
-        final_context = MedicalReranker.build_context(reranked_chunks)
+        results = ChatPipeline.answer_batch(
+            queries, filters=filters, budget_s=ChatPipeline.REQUEST_BUDGET_S
+        )
 
-        prompt = PromptAssembler.assemble_prompt(query, evidence_docs, flag)
+        return StreamingHttpResponse(
+            (json.dumps(result) + "\n" for result in results),
+            content_type="application/x-ndjson"
+        )
 
-        final_answer = FinalAnswerGenerator.generate_final_answer(prompt)
 
-        return Response({"answer":final_answer})
+class GenerationCacheStatsView(APIView):
+    # Counters are per worker process.
+    def get(self, request):
+        return Response(GenerationCache.stats())
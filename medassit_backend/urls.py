@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.urls import path
-from medassist_backend_app.views import ChatView
+from medassist_backend_app.views import BatchChatView, ChatView, GenerationCacheStatsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('chat/', ChatView.as_view(), name='ChatView'),
+    path('chat/batch/', BatchChatView.as_view(), name='BatchChatView'),
+    path('chat/cache-stats/', GenerationCacheStatsView.as_view(), name='GenerationCacheStatsView'),
 ]
\ No newline at end of file
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medassit_backend.settings')
 
 application = get_wsgi_application()
+
+# Importing the app no longer builds Azure clients; opt in to doing it at
+# worker boot instead of on the first request.
+if os.getenv('MEDASSIST_WARMUP') == '1':
+    from medassist_backend_app.pipeline import ChatPipeline
+
+    ChatPipeline.warm_up()